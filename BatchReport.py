@@ -0,0 +1,349 @@
+# Batch Report
+
+###############################################################################
+"""
+In this .py file, we will render every year x category x quantile scheme x
+ BRAC window figure headlessly in a process pool, writing them with a
+ manifest to the ImagesOutput folder and skipping unchanged figures.
+"""
+###############################################################################
+
+# import packages
+import os
+import json
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import geopandas
+import matplotlib
+matplotlib.use('Agg')  # headless backend, set before pyplot is imported
+import Visualizations as vis
+import DataManipulation as dm
+from FigureTemplates import get_template, LineTemplate
+
+
+MANIFEST = os.path.join(vis.IMAGEPATH, 'manifest.json')
+
+# years covered by the BEA job shares and the BLS monthly data
+YEARS = [2005, 2006, 2007]
+CATEGORIES = ['manufacturing', 'military']
+# percentile cutoffs for the non-zero shares, terciles as in the Shiny app
+# and quartiles as in DataManipulation.py
+QUANTILE_SCHEMES = {'terciles': [33.33, 66.67],
+                    'quartiles': [25, 50, 75]}
+# brac 2005 windows, commission recommendations to the commission report
+# and to the recommendations becoming law
+BRAC_WINDOWS = {'commission': vis.BRAC_WINDOW,
+                'enactment': ('05-01', '11-01')}
+# raw and seasonally adjusted rates, adjusted figures get an _sa suffix
+RATES = {'raw': False, 'sa': True}
+
+
+# %% Section 1 Data Preparation
+
+# BEA and crosswalk sources, loaded and cleaned as in DataManipulation.py
+# alongside Visualizations' sources
+SHARE_JOBS = {name: dm.SOURCE_JOBS[name] for name in ['bea', 'crosswalk']}
+
+
+def prepare_share_panel(msa_bls, bea, crosswalk):
+    """Merge msa-year BEA job shares onto the monthly BLS panel."""
+    """Follows the Shiny app: county jobs are summed to msas through the
+    crosswalk, and msas without BEA jobs get a zero share. bea and crosswalk
+    are cleaned by DataManipulation.py, which keeps years as strings and
+    suppressed job counts as nan."""
+    bea = bea.dropna().astype({'year': int})
+    msa_jobs = bea.merge(crosswalk, on='county', how='inner')\
+        .rename(columns={'fipscode': 'msa_code'})\
+        .groupby(['msa_code', 'year'])[['military', 'manufacturing',
+                                        'total']].sum().reset_index()
+    for category in CATEGORIES:
+        msa_jobs[f'{category}_share'] = msa_jobs[category] / msa_jobs['total']
+
+    # attach the annual shares to every month of the year
+    bls = msa_bls[msa_bls['year'].isin(YEARS)]\
+        .rename(columns={'area fips code': 'msa_code'})
+    bls['datetime'] = pd.to_datetime(dict(year=bls['year'],
+                                          month=bls['month'], day=1))
+    panel = msa_jobs.merge(bls, on=['msa_code', 'year'], how='right')
+    share_columns = [f'{category}_share' for category in CATEGORIES]
+    panel[share_columns] = panel[share_columns].fillna(0)
+    return panel
+
+
+# %% Section 2 Quantile Plots
+
+def assign_quantiles(msa_yr, share_column, cutoffs):
+    """Label each row by its share quantile, with zero shares kept apart."""
+    share = msa_yr[share_column].to_numpy()
+    edges = np.percentile(share[share != 0], cutoffs)
+    labels = np.array([f'Q{i + 1}' for i in range(len(cutoffs) + 1)])
+    # searchsorted puts share <= first edge in Q1, and so on, like the app
+    quantile = labels[np.searchsorted(edges, share)]
+    return np.where(share == 0, 'Zero', quantile)
+
+
+def plot_quantiles(panel, category, cutoffs, year, brac_window, fname,
+                   seasonal=False):
+    """Graph the share quantile and zero curves for a given year."""
+    share_column = f'{category}_share'
+    msa_yr = panel[panel['year'] == year]
+    msa_yr = msa_yr.assign(quantile=assign_quantiles(msa_yr, share_column,
+                                                     cutoffs))
+    means = msa_yr.groupby(['quantile', 'datetime'])\
+        [vis.RATE_COLUMNS[seasonal]].mean().unstack('quantile')
+
+    # one template per scheme, with a line per quantile and zero group first
+    labels = ['Zero'] + [f'Q{i + 1}' for i in range(len(cutoffs) + 1)]
+    template = get_template(('quantiles', len(labels)), lambda: LineTemplate(
+        labels, ['-'] * len(labels), figsize=(8, 6), managed=False))
+    template.update({label: means[label] for label in means.columns},
+                    f'Average Unemp Rate by {category.capitalize()} Share '
+                    f'Quantiles, {year}' +
+                    (', Seasonally Adjusted' if seasonal else ''),
+                    vis.brac_dates(year, brac_window))
+    template.savefig(os.path.join(vis.IMAGEPATH, fname))
+
+
+# %% Section 3 Figure Tasks
+
+def digest(params, *frames):
+    """Hash the figure parameters and input frames to detect changes."""
+    sha = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+    for frame in frames:
+        if isinstance(frame, geopandas.GeoDataFrame):
+            # hash geometries by their bounds to keep hashing cheap
+            frame = pd.concat([frame.select_dtypes(exclude='geometry'),
+                               frame.geometry.bounds], axis=1)
+        sha.update(pd.util.hash_pandas_object(frame, index=False)
+                   .to_numpy().tobytes())
+    return sha.hexdigest()
+
+
+def year_windows(year):
+    """BRAC windows to draw for year, only the BRAC year has any."""
+    return list(BRAC_WINDOWS) if year == vis.BRAC_YEAR else [None]
+
+
+def window_suffix(window, rate):
+    """File name suffix of the window and the rate of a figure."""
+    return (f'_{window}' if window else '') + ('_sa' if RATES[rate] else '')
+
+
+def list_figures(years, map_mode='auto'):
+    """List every figure with its output name and parameters."""
+    tasks = []
+    for year, rate in itertools.product(years, RATES):
+        for window in year_windows(year):
+            tasks.append({'name': f'gains_losses_{year}'
+                          f'{window_suffix(window, rate)}',
+                          'kind': 'gains_losses',
+                          'params': {'year': year, 'window': window,
+                                     'rate': rate}})
+
+    # job shares only exist for the BEA years
+    share_years = [year for year in years if year in YEARS]
+    for year, category, scheme, rate in itertools.product(
+            share_years, CATEGORIES, QUANTILE_SCHEMES, RATES):
+        for window in year_windows(year):
+            tasks.append({'name': f'quantiles_{category}_{scheme}_{year}'
+                          f'{window_suffix(window, rate)}',
+                          'kind': 'quantiles',
+                          'params': {'year': year, 'category': category,
+                                     'scheme': scheme, 'window': window,
+                                     'rate': rate}})
+
+    for kind in ['map_continental', 'map_allstates']:
+        tasks.append({'name': kind, 'kind': kind,
+                      'params': {'mode': map_mode}})
+
+    for task in tasks:
+        task['file'] = task['name'] + '.png'
+    return tasks
+
+
+def figure_inputs(task, merged, panel, data):
+    """Hash the parameters and input frames of one figure task."""
+    params = task['params']
+    if task['kind'] == 'gains_losses':
+        frames = [merged[params['year']]]
+    elif task['kind'] == 'quantiles':
+        frames = [panel[panel['year'] == params['year']]]
+    else:
+        frames = [data['gdf_msa_conti'], data['gdf_state_conti']]
+        if task['kind'] == 'map_allstates':
+            frames += list(data['territories'])
+    return digest(params, *frames)
+
+
+def enumerate_figures(merged, panel, data, years, map_mode='auto'):
+    """List every figure with its output name, parameters and input hash."""
+    tasks = list_figures(years, map_mode)
+    for task in tasks:
+        task['inputs'] = figure_inputs(task, merged, panel, data)
+    return tasks
+
+
+# prepared data shared by the worker processes, set once per worker
+_DATA = {}
+
+
+def _init_worker(data):
+    """Keep the prepared data in the worker so tasks only send parameters."""
+    _DATA.update(data)
+
+
+def render_figure(task):
+    """Render one figure task with the data prepared for this worker."""
+    params = task['params']
+    if task['kind'] == 'gains_losses':
+        vis.plot_gains_losses(_DATA['merged'][params['year']],
+                              params['year'],
+                              BRAC_WINDOWS.get(params['window']),
+                              task['file'], show=False,
+                              seasonal=RATES[params['rate']])
+    elif task['kind'] == 'quantiles':
+        plot_quantiles(_DATA['panel'], params['category'],
+                       QUANTILE_SCHEMES[params['scheme']], params['year'],
+                       BRAC_WINDOWS.get(params['window']), task['file'],
+                       RATES[params['rate']])
+    elif task['kind'] == 'map_continental':
+        vis.plot_continentalUS(_DATA['gdf_msa_conti'],
+                               _DATA['gdf_state_conti'], 'direct',
+                               task['file'], show=False,
+                               mode=params['mode'])
+    elif task['kind'] == 'map_allstates':
+        vis.plot_all_continents_territories(_DATA['gdf_state_conti'],
+                                            _DATA['gdf_msa_conti'],
+                                            _DATA['territories'],
+                                            _DATA['brac_new'], task['file'],
+                                            show=False, mode=params['mode'])
+    return task['name']
+
+
+# %% Section 4 Batch Run
+
+def source_files():
+    """Paths of the data files and shapefiles all figures are made from."""
+    data_files = ['ssamatab1.xlsx', 'hw2_data.csv', 'Table.csv',
+                  'geocorr2018_2327800015.csv']
+    shapefiles = [('tl_2019_us_cbsa', 'tl_2019_us_cbsa.shp'),
+                  ('cb_2018_us_state_5m', 'cb_2018_us_state_5m.shp')]
+    return [os.path.join(vis.DATAPATH, fname) for fname in data_files]\
+        + [os.path.join(vis.PATH, *shapefile) for shapefile in shapefiles]
+
+
+def sources_digest():
+    """Hash the size and modification time of every source file."""
+    """Cheap enough to check before loading anything, so a rerun with
+    unchanged sources can skip the loads entirely."""
+    stats = []
+    for path in source_files():
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stats.append([path, stat.st_size, stat.st_mtime_ns])
+        else:
+            stats.append([path, None, None])
+    return hashlib.sha256(json.dumps(stats).encode()).hexdigest()
+
+
+def load_manifest():
+    """Read the manifest of previously rendered figures, if there is one."""
+    if not os.path.exists(MANIFEST):
+        return {'figures': {}}
+    with open(MANIFEST) as f:
+        return json.load(f)
+
+
+def is_rendered(task, manifest):
+    """Check the figure file exists and its last render succeeded."""
+    entry = manifest['figures'].get(task['name'])
+    return (entry is not None and entry.get('status', 'ok') == 'ok'
+            and entry['params'] == task['params']
+            and os.path.exists(os.path.join(vis.IMAGEPATH, task['file'])))
+
+
+def is_up_to_date(task, manifest):
+    """Check the figure exists and was rendered from the same inputs."""
+    return (is_rendered(task, manifest)
+            and manifest['figures'][task['name']]['inputs'] == task['inputs'])
+
+
+def run_batch(years=YEARS, workers=None, force=False, map_mode='auto'):
+    """Render all changed figures in a process pool and update the manifest."""
+    """A figure that fails is recorded in the manifest with its error and
+    the other figures still render."""
+    manifest = load_manifest()
+    sources = sources_digest()
+    tasks = list_figures(years, map_mode)
+    # unchanged source files and rendered figures need no data at all
+    if not force and manifest.get('sources') == sources\
+            and all(is_rendered(task, manifest) for task in tasks):
+        print(f'All {len(tasks)} figures are up to date')
+        return manifest
+
+    # prepare the data once in the parent process, with all six sources
+    # loading concurrently
+    data = vis.prepare_data(extra_jobs=SHARE_JOBS)
+    merged = {year: vis.group_and_merge(data['brac'],
+                                        vis.modify_file(data['msa_bls'],
+                                                        year),
+                                        'area fips code')[1]
+              for year in years}
+    panel = prepare_share_panel(data['msa_bls'], data['bea'],
+                                data['crosswalk'])
+
+    tasks = enumerate_figures(merged, panel, data, years, map_mode)
+    pending = [task for task in tasks
+               if force or not is_up_to_date(task, manifest)]
+    print(f'{len(pending)} of {len(tasks)} figures need rendering')
+    manifest['sources'] = sources
+
+    worker_data = {'merged': merged, 'panel': panel,
+                   'brac_new': data['brac_new'],
+                   'gdf_msa_conti': data['gdf_msa_conti'],
+                   'gdf_state_conti': data['gdf_state_conti'],
+                   'territories': data['territories']}
+    failed = []
+    try:
+        if pending:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_worker,
+                                     initargs=(worker_data,)) as pool:
+                futures = {pool.submit(render_figure, task): task
+                           for task in pending}
+                for future in as_completed(futures):
+                    task = futures[future]
+                    entry = {'file': task['file'], 'kind': task['kind'],
+                             'params': task['params'],
+                             'inputs': task['inputs'], 'status': 'ok'}
+                    try:
+                        future.result()
+                    except Exception as error:
+                        entry.update(status='failed', error=repr(error))
+                        failed.append(task['name'])
+                    manifest['figures'][task['name']] = entry
+    finally:
+        # record finished figures even when the run is interrupted
+        with open(MANIFEST, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+    if failed:
+        print(f'{len(failed)} figures failed, see {MANIFEST}: '
+              + ', '.join(sorted(failed)))
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render all BRAC figures.')
+    parser.add_argument('--years', type=int, nargs='+', default=YEARS)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes, default is cpu count')
+    parser.add_argument('--force', action='store_true',
+                        help='render figures even if inputs are unchanged')
+    parser.add_argument('--map-mode', choices=vis.MAP_MODES, default='auto',
+                        help="map rendering mode, 'full' keeps all detail")
+    args = parser.parse_args()
+    run_batch(args.years, args.workers, args.force, args.map_mode)
@@ -0,0 +1,46 @@
+# Data Loader
+
+###############################################################################
+"""
+In this .py file, we will load independent source files concurrently and run
+ each file's cleaning stage as soon as that file has been read, so startup
+ takes about as long as the slowest single load instead of their sum.
+"""
+###############################################################################
+
+# import packages
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor,\
+    as_completed
+
+
+EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
+
+def run_job(load, args, stage):
+    """Load one source and run its cleaning stage in the same worker."""
+    frame = load(*args)
+    if stage is not None:
+        frame = stage(frame)
+    return frame
+
+
+def load_concurrently(jobs, executor='thread', max_workers=None):
+    """Yield (name, frame) pairs as soon as each source is loaded and clean."""
+    """jobs maps a name to a (load, args, stage) tuple, where stage cleans the
+    loaded frame or is None. Threads overlap file and shapefile reads, while
+    'process' also overlaps parses holding the GIL such as Excel, but only
+    suits callers whose run code sits behind a __main__ guard, because
+    spawned workers import the calling script."""
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor '{executor}', use 'thread' or "
+                         "'process'.")
+    with EXECUTORS[executor](max_workers=max_workers or len(jobs)) as pool:
+        futures = {pool.submit(run_job, *job): name
+                   for name, job in jobs.items()}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def load_all(jobs, executor='thread', max_workers=None):
+    """Load and clean all sources concurrently and return them by name."""
+    return dict(load_concurrently(jobs, executor, max_workers))
@@ -11,6 +11,9 @@ In this .py file, we will clean and merge county-level BEA data and
 import pandas as pd
 import numpy as np
 import os
+from DataLoader import load_all
+from SeasonalAdjustment import add_adjusted_column
+from Validation import ValidationReport, NUMERIC, TEXT
 
 
 PATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
@@ -18,6 +21,16 @@ PATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
 DATAPATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
     r'\\msa-brac-employment-spatial\\Data'
 
+# declared columns and dtype kinds of the cleaned sources
+BEA_SCHEMA = {'county': TEXT, 'year': TEXT, 'manufacturing': NUMERIC,
+              'military': NUMERIC, 'total': NUMERIC}
+BLS_SCHEMA = {'area fips code': NUMERIC, 'msa': TEXT, 'year': TEXT,
+              'month': NUMERIC, 'unemployment_rate': NUMERIC,
+              'unemployment_rate_sa': NUMERIC}
+CROSSWALK_SCHEMA = {'fipscode': NUMERIC, 'county': TEXT, 'msa': TEXT}
+# raw and seasonally adjusted unemployment rate columns
+RATE_COLUMNS = ['unemployment_rate', 'unemployment_rate_sa']
+
 # %% Section 1 Functions
 
 def load_file(fname, ftype, skiprows, skipfooter, na_values, remains, yr_str):
@@ -54,20 +67,15 @@ def clean_names(df, column_name, strings):
         df[column_name] = df[column_name].str.replace(string, '', regex=True)
 
 
-def explore_merge(df):
-    """Explore merged df and the _merge column."""
-    print(df.dtypes)
-    print([df['_merge']])
-    print(df[df['_merge'] != 'both'])
-
-
-def calculate_share_quartiles(df, category, share_column, year, qua_name):
+def calculate_share_quartiles(df, category, share_column, year, qua_name,
+                              rate_columns=RATE_COLUMNS):
     """Calculate share of a kind of job among all jobs."""
-    """And split by quartiles. Apply the quartiles to all years."""
+    """And split by quartiles. Apply the quartiles to all years. All
+    rate_columns are kept for quartile_unemp_difference."""
     # calculate share and group df by msa and year, filter base year data
     df[share_column] = df[category]/df['total']
-    df_msa_share = df.groupby(['msa', 'year'])['unemployment_rate',
-                                               share_column]\
+    df_msa_share = df.groupby(['msa', 'year'])[list(rate_columns) +
+                                               [share_column]]\
         .mean().reset_index()
     msa_yr_category = df_msa_share[df_msa_share['year'] == year]
 
@@ -97,24 +105,26 @@ def calculate_share_quartiles(df, category, share_column, year, qua_name):
     return df_msa_share
 
 
-def quartile_unemp_difference(df, category, qua_name, base_year, year_2):
+def quartile_unemp_difference(df, category, qua_name, base_year, year_2,
+                              rate_column='unemployment_rate'):
     """Calculate mean unemployment by base_year category share quartile."""
-    """For base year and year_2 and their differences."""
+    """For base year and year_2 and their differences. rate_column can be
+    the seasonally adjusted unemployment_rate_sa."""
     # calculate base year and year 2 mean unemp rates for each quartile
     unemp_q_yr1 = (df[df['year'] == base_year])\
-        .groupby([qua_name])['unemployment_rate'].mean().reset_index()
+        .groupby([qua_name])[rate_column].mean().reset_index()
     unemp_q_yr2 = (df[df['year'] == year_2])\
-        .groupby([qua_name])['unemployment_rate'].mean().reset_index()
+        .groupby([qua_name])[rate_column].mean().reset_index()
 
     # find differences in means
-    unemp_change = pd.Series(unemp_q_yr2['unemployment_rate'].values
-                             - unemp_q_yr1['unemployment_rate'].values,
+    unemp_change = pd.Series(unemp_q_yr2[rate_column].values
+                             - unemp_q_yr1[rate_column].values,
                              index=['Q1', 'Q2', 'Q3', 'Q4'])
-    print(f"""Mean unemployment by {base_year} military share quartile for
-          {base_year} is \n""", unemp_q_yr1)
-    print(f"""Mean unemployment by {base_year} military share quartile for
-          {year_2} is \n""", unemp_q_yr2)
-    print(f"""The mean change in the unemployment rate between {base_year} and
+    print(f"""Mean {rate_column} by {base_year} {category} share quartile
+          for {base_year} is \n""", unemp_q_yr1)
+    print(f"""Mean {rate_column} by {base_year} {category} share quartile
+          for {year_2} is \n""", unemp_q_yr2)
+    print(f"""The mean change in {rate_column} between {base_year} and
           {year_2} for each categorical quartile is the following \n""",
           unemp_change)
 
@@ -123,113 +133,186 @@ def quartile_unemp_difference(df, category, qua_name, base_year, year_2):
 
 # 2. Preparing the county-level BEA data
 
-bea = load_file('Table.csv', 'csv', 3, 13, ['(D)', '(NA)'],
-                ['GeoName', 'Description', '2005', '2006', '2007'], False)
+def reshape_bea(bea):
+    """Reshape county BEA jobs to long format with a total column."""
+    # transform bea into long (tidy) format to be ready for merging
+    # and add column "total" as sum of manufactuing and military jobs
+    bea = bea.melt(id_vars=['geoname', 'description'],
+                   var_name='year', value_name='Value')
+    bea = bea.pivot(index=['geoname', 'year'], columns='description',
+                    values='Value').reset_index()
+    bea.columns = [c.strip() for c in bea.columns]
+    bea['total'] = bea['Manufacturing'] + bea['Military']
 
-# transform bea into long (tidy) format to be ready for merging
-# and add column "total" as sum of manufactuing and military jobs
-bea = bea.melt(id_vars=['geoname', 'description'],
-               var_name='year', value_name='Value')
-bea = bea.pivot(index=['geoname', 'year'], columns='description',
-                values='Value').reset_index()
-bea.columns = [c.strip() for c in bea.columns]
-bea['total'] = bea['Manufacturing'] + bea['Military']
-
-# rename columns to follow style guide
-bea.rename(columns={'Manufacturing': 'manufacturing',
-                    'Military': 'military',
-                    'geoname': 'county'}, inplace=True)
-bea.head()
+    # rename columns to follow style guide
+    bea.rename(columns={'Manufacturing': 'manufacturing',
+                        'Military': 'military',
+                        'geoname': 'county'}, inplace=True)
+    return bea
 
 
 # 3. Preparing the MSA-level BLS data
 
-msa_bls = load_file('ssamatab1.xlsx', 'excel', [0, 1, 3], 5, ['(n)'],
-                    ['Area', 'Year', 'Month', 'Unemployment Rate'], True)
-
-# rename columns and clean msas for merging purposes
-msa_bls.rename(columns={'area': 'msa',
-                        'unemployment rate': 'unemployment_rate'},
-               inplace=True)
-clean_names(msa_bls, 'msa', [' MSA', ' Met NECTA'])
+def clean_bls(msa_bls):
+    """Rename BLS columns and clean msa names for merging."""
+    # rename columns and clean msas for merging purposes
+    msa_bls.rename(columns={'area': 'msa',
+                            'unemployment rate': 'unemployment_rate'},
+                   inplace=True)
+    clean_names(msa_bls, 'msa', [' MSA', ' Met NECTA'])
+    # add the seasonally adjusted rate, estimated for all msas at once and
+    # keyed by code, since an msa and a necta can share a cleaned name
+    return add_adjusted_column(msa_bls, 'area fips code', 'unemployment_rate',
+                               'unemployment_rate_sa')
 
 
 # 4. Preparing the county-MSA crosswalk
 
-crosswalk = load_file('geocorr2018_2327800015.csv', 'csv', [1], 0, '-',
-                      ['cbsa10', 'cntyname', 'cbsaname10'], False)
-crosswalk = crosswalk[(crosswalk['cbsaname10'] != '99999')]
-
-# modify county and msa columns to match with the other dataframes
-# add comma inbetween state and county to match with msa county column
-crosswalk['cntyname'] = crosswalk['cntyname'].apply(lambda x:
-                                                    x[:-3] + ', ' + x[-2:])
-crosswalk.rename(columns={'cntyname': 'county',
-                          'cbsaname10': 'msa',
-                          'cbsa10': 'fipscode'}, inplace=True)
-
-# use clean_names function created earlier to delete unwanted strings
-clean_names(crosswalk, 'msa', [' Metropolitan Statistical Area',
-                               ' Micropolitan Statistical Area',
-                               ' Metropolitan Statistical',
-                               ' Micropolitan Statistical'])
+def clean_crosswalk(crosswalk):
+    """Keep counties in an msa and match county and msa names to the rest."""
+    crosswalk = crosswalk[(crosswalk['cbsaname10'] != '99999')].copy()
+
+    # modify county and msa columns to match with the other dataframes
+    # add comma inbetween state and county to match with msa county column
+    crosswalk['cntyname'] = crosswalk['cntyname'].apply(lambda x:
+                                                        x[:-3] + ', ' +
+                                                        x[-2:])
+    crosswalk.rename(columns={'cntyname': 'county',
+                              'cbsaname10': 'msa',
+                              'cbsa10': 'fipscode'}, inplace=True)
+
+    # use clean_names function created earlier to delete unwanted strings
+    clean_names(crosswalk, 'msa', [' Metropolitan Statistical Area',
+                                   ' Micropolitan Statistical Area',
+                                   ' Metropolitan Statistical',
+                                   ' Micropolitan Statistical'])
+    return crosswalk
+
+
+# (load, args, stage) jobs of the three sources, also used by BatchReport.py
+SOURCE_JOBS = {
+    'bea': (load_file, ('Table.csv', 'csv', 3, 13, ['(D)', '(NA)'],
+                        ['GeoName', 'Description', '2005', '2006', '2007'],
+                        False), reshape_bea),
+    'msa_bls': (load_file, ('ssamatab1.xlsx', 'excel', [0, 1, 3], 5,
+                            ['(n)'], ['Area FIPS Code', 'Area', 'Year',
+                                      'Month', 'Unemployment Rate'], True),
+                clean_bls),
+    'crosswalk': (load_file, ('geocorr2018_2327800015.csv', 'csv', [1], 0,
+                              '-', ['cbsa10', 'cntyname', 'cbsaname10'],
+                              False), clean_crosswalk)}
+
+
+def load_sources():
+    """Load and clean the BEA, BLS and crosswalk files concurrently."""
+    """The three files are independent and every parse holds the GIL (the
+    python csv engine needed by skipfooter, and the excel file, the slowest),
+    so they load in worker processes, each cleaned as soon as it is read."""
+    return load_all(SOURCE_JOBS, executor='process')
+
+
+def validate_sources(bea, msa_bls, crosswalk):
+    """Check each cleaned source against its schema, keys and the others."""
+    """The report stops the script at the first failed check and is written
+    to validation/. The BLS key is the area code because an msa and a necta
+    can share a cleaned name, such names are averaged together by the annual
+    groupby in merge_sources."""
+    report = ValidationReport('data_manipulation')
+    for name, df, schema, keys in [
+            ('bea', bea, BEA_SCHEMA, ['county', 'year']),
+            ('msa_bls', msa_bls, BLS_SCHEMA, ['area fips code', 'year',
+                                              'month']),
+            ('crosswalk', crosswalk, CROSSWALK_SCHEMA, ['county'])]:
+        report.check_schema(df, name, schema)
+        report.check_unique(df, name, keys)
+
+    # counties outside any msa and msas outside the BLS table are expected,
+    # so coverage between the sources is reported without a threshold
+    report.check_coverage(bea['county'], crosswalk['county'], 'bea',
+                          'crosswalk county')
+    report.check_coverage(crosswalk['county'], bea['county'], 'crosswalk',
+                          'bea county')
+    report.check_coverage(crosswalk['msa'], msa_bls['msa'], 'crosswalk',
+                          'msa_bls msa')
+    report.check_coverage(msa_bls['msa'], crosswalk['msa'], 'msa_bls',
+                          'crosswalk msa')
+    return report
 
 
 # %% Section 3 Dataset Merging
 
 # 5. Merging
 
-# The two merged dfs are investigated types and _merge using explore_merge func
-
-# Inner merge bea and crosswalk first
-bea_crosswalk = bea.merge(crosswalk, on='county', how='inner', indicator=True)
-explore_merge(bea_crosswalk)
-bea_crosswalk = bea_crosswalk.drop('_merge', axis=1)
-
-# Merge bea_crosswalk with the newly reshaped bls dataframe so that annual
-# jobs and unemployment rate data are categorized in area-county
-msa_bls_annual = msa_bls.groupby(['msa', 'year'])['unemployment_rate'].mean().reset_index()
-bea_bls = bea_crosswalk.merge(msa_bls_annual, on=['msa', 'year'], how='inner',
-                              indicator=True)
-explore_merge(bea_bls)
-bea_bls = bea_bls.drop('_merge', axis=1)
-bea_bls.dropna(inplace=True)  # keep rows with only complete data
-bea_bls.head()
-print("""The merges look fine, with exploration of _merge, there are no
-      non-both data""")
+def merge_sources(bea, msa_bls, crosswalk, report):
+    """Merge county jobs with annual msa unemployment through the crosswalk."""
+    """Rows dropped by each merge and by incomplete data are counted in the
+    report."""
+    # Inner merge bea and crosswalk first
+    bea_crosswalk = bea.merge(crosswalk, on='county', how='inner')
+    report.count_dropped(bea, bea_crosswalk, 'bea_crosswalk',
+                         'inner merge on county')
+    report.check_unique(bea_crosswalk, 'bea_crosswalk', ['county', 'year'])
+
+    # Merge bea_crosswalk with the newly reshaped bls dataframe so that annual
+    # jobs and unemployment rate data are categorized in area-county
+    msa_bls_annual = msa_bls.groupby(['msa', 'year'])[[
+        'unemployment_rate', 'unemployment_rate_sa']].mean().reset_index()
+    bea_bls = bea_crosswalk.merge(msa_bls_annual, on=['msa', 'year'],
+                                  how='inner')
+    report.count_dropped(bea_crosswalk, bea_bls, 'bea_bls',
+                         'inner merge on msa and year')
+
+    # keep rows with only complete data
+    complete = bea_bls.dropna()
+    report.count_dropped(bea_bls, complete, 'bea_bls', 'drop incomplete rows')
+    return complete
 
 
 # %% Section 4 Exploration
 
 # 6. Basic exploration
 
-# Q: divide each MSA up into one of four quartiles based on the military share
-# of total employment in 2005 using calculate_share_quartiles function
-
-military_msa = calculate_share_quartiles(bea_bls, 'military', 'military_share',
-                                         '2005', 'qua_mi_2005')
-
-# calculate mean unemployment by 2005 military share quartile for 2005
-# and 2006 and print their differences
-quartile_unemp_difference(military_msa, "military", 'qua_mi_2005', "2005",
-                          "2006")
-print("""The military share difference table indicates the MSAs with a higher
-      proportion of military employment in 2005 see a greater negative change
-      in the unemployment from 2005 to 2006. However, in Q3, the percentage
-      changed drops but went back high to ~0.47pp in Q4.""")
-
-# Q: divide each MSA up into one of four quartiles based on the manufacturing
-# share of total employment in 2005 using calculate_share_quartiles function
-manufacturing_msa = calculate_share_quartiles(bea_bls, 'manufacturing',
-                                              'manufacturing_share',
-                                              '2005', 'qua_ma_2005')
-
-# calculate mean unemployment by 2005 manufacturing share quartile for 2005
-# and 2006 and print their differences
-quartile_unemp_difference(manufacturing_msa, "manufacturing", 'qua_ma_2005',
-                          "2005", "2006")
-print("""The manufacturing share difference indicates the MSAs with a higher
-      proportion of military employment in 2005 see a lesser negative change
-      in the unemployment from 2005 to 2006. However, in Q3, the percentage
-      changed surged but went back low to ~0.27pp in Q4. Overall, it is the
-      opposite to the military share changes.""")
+if __name__ == '__main__':
+    sources = load_sources()
+    bea = sources['bea']
+    msa_bls = sources['msa_bls']
+    crosswalk = sources['crosswalk']
+    report = validate_sources(bea, msa_bls, crosswalk)
+    bea_bls = merge_sources(bea, msa_bls, crosswalk, report)
+    print(f"All merge checks passed, see {report.write()}")
+
+    # Q: divide each MSA up into one of four quartiles based on the military
+    # share of total employment in 2005 using calculate_share_quartiles
+    military_msa = calculate_share_quartiles(bea_bls, 'military',
+                                             'military_share', '2005',
+                                             'qua_mi_2005')
+
+    # calculate mean raw and seasonally adjusted unemployment by 2005
+    # military share quartile for 2005 and 2006 and print their differences
+    for rate_column in RATE_COLUMNS:
+        quartile_unemp_difference(military_msa, "military", 'qua_mi_2005',
+                                  "2005", "2006", rate_column)
+    print("""The raw military share difference table indicates the MSAs with a
+          higher proportion of military employment in 2005 see a greater
+          negative change in the unemployment from 2005 to 2006. However, in
+          Q3, the percentage changed drops but went back high to ~0.47pp in
+          Q4.""")
+
+    # Q: divide each MSA up into one of four quartiles based on the
+    # manufacturing share of total employment in 2005 using
+    # calculate_share_quartiles function
+    manufacturing_msa = calculate_share_quartiles(bea_bls, 'manufacturing',
+                                                  'manufacturing_share',
+                                                  '2005', 'qua_ma_2005')
+
+    # calculate mean raw and seasonally adjusted unemployment by 2005
+    # manufacturing share quartile for 2005 and 2006 and print their
+    # differences
+    for rate_column in RATE_COLUMNS:
+        quartile_unemp_difference(manufacturing_msa, "manufacturing",
+                                  'qua_ma_2005', "2005", "2006", rate_column)
+    print("""The raw manufacturing share difference indicates the MSAs with a
+          higher proportion of military employment in 2005 see a lesser
+          negative change in the unemployment from 2005 to 2006. However, in
+          Q3, the percentage changed surged but went back low to ~0.27pp in
+          Q4. Overall, it is the opposite to the military share changes.""")
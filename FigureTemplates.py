@@ -0,0 +1,188 @@
+# Figure Templates
+
+###############################################################################
+"""
+In this .py file, we will build each figure once as a template and, on later
+ renders, update only its line data, collection arrays and titles, so the
+ cost of a render follows the data instead of the figure setup.
+"""
+###############################################################################
+
+# import packages
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from mpl_toolkits.axes_grid1 import make_axes_locatable
+
+
+# templates built in this process, keyed by figure name and layout
+_TEMPLATES = {}
+
+
+def get_template(key, build):
+    """Return the cached template for key, building it on first use."""
+    template = _TEMPLATES.get(key)
+    # a pyplot window closed since the last render needs a new figure
+    if template is None or (template.managed
+                            and not plt.fignum_exists(template.fig.number)):
+        template = build()
+        _TEMPLATES[key] = template
+    return template
+
+
+def new_figure(figsize, managed):
+    """Create a pyplot figure, or a standalone Agg figure pyplot never sees."""
+    """Standalone figures suit servers and worker processes, where pyplot
+    closing or tracking the figure would defeat reusing it."""
+    if managed:
+        return plt.subplots(figsize=figsize)
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots()
+
+
+def point_sizes(values, top=None, smallest=8, largest=200):
+    """Scale marker areas with the absolute values, up to the top value."""
+    """Passing the same top to several subplots keeps their sizes on one
+    scale."""
+    magnitude = np.abs(np.asarray(values, dtype=float))
+    if top is None:
+        top = magnitude.max() if len(magnitude) else 0
+    if top == 0:
+        return np.full(len(magnitude), smallest, dtype=float)
+    return smallest + (largest - smallest) * magnitude / top
+
+
+# %% Section 1 Line Plots
+
+class LineTemplate:
+    """Monthly unemployment lines with BRAC start and end markers."""
+
+    def __init__(self, labels, styles, figsize, managed=True):
+        self.managed = managed
+        self.fig, self.ax = new_figure(figsize, managed)
+
+        # one empty line per group, filled in by update
+        self.lines = {}
+        for label, style in zip(labels, styles):
+            self.lines[label], = self.ax.plot([], [], style, label=label)
+
+        # BRAC start and end lines with annotations, moved by update
+        self.vlines = [self.ax.axvline(0, color='k', linestyle=':')
+                       for _ in range(2)]
+        self.notes = [self.ax.annotate(text=text, xy=(0, 0))
+                      for text in ['BRAC start', 'BRAC end']]
+
+        # format month on the x-axis, dates are kept as matplotlib numbers
+        self.ax.xaxis.set_major_locator(mdates.MonthLocator())
+        self.ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+        self.ax.tick_params(axis='x', labelrotation=45)
+
+        # add relevant labels
+        self.ax.legend(loc='best')
+        self.ax.set_ylabel('Unemployment rate (%)')
+        self.ax.set_xlabel('Date')
+
+    def update(self, series, title, brac_window=None):
+        """Set new line data, BRAC markers and title on the template."""
+        """series maps labels to date-indexed means, labels without data are
+        hidden, and brac_window is a (start, end) pair of dates or None."""
+        lows = []
+        for label, line in self.lines.items():
+            data = series.get(label)
+            if data is None or data.empty:
+                line.set_visible(False)
+                continue
+            line.set_data(mdates.date2num(data.index), data.to_numpy())
+            line.set_visible(True)
+            lows.append(np.nanmin(data.to_numpy()))
+
+        # get the best vertical position for BRAC start and BRAC end
+        text_position = min(lows) if lows else 0
+        show_window = brac_window is not None
+        if show_window:
+            positions = mdates.date2num(pd.to_datetime(list(brac_window)))
+            for vline, note, x in zip(self.vlines, self.notes, positions):
+                vline.set_xdata([x, x])
+                note.xy = (x, text_position)
+        for artist in self.vlines + self.notes:
+            artist.set_visible(show_window)
+
+        self.ax.set_title(title)
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+
+    def savefig(self, fname):
+        """Export the current state of the template with the Agg renderer."""
+        self.fig.savefig(fname)
+
+
+# %% Section 2 Choropleths
+
+class MapTemplate:
+    """MSA choropleth over white state edges with one colorbar."""
+    """With points=True the msas are points sized by the absolute value."""
+
+    def __init__(self, gdf, edge, column, title, figsize=(9, 6),
+                 cmap='coolwarm', managed=True, points=False):
+        self.managed = managed
+        self.points = points
+        self.fig, self.ax = new_figure(figsize, managed)
+        divider = make_axes_locatable(self.ax)
+        cax = divider.append_axes('right', size='5%', pad=0.1)
+
+        # geopandas leaves msas with missing values out of the plot, which
+        # would misalign the values of later renders
+        if gdf[column].isna().any():
+            raise ValueError(f"Column '{column}' has missing values, fill "
+                             "them before building the map template.")
+
+        # plot edge and msas once, later renders only recolor them, and for
+        # point geometries also resize the markers
+        edge.plot(ax=self.ax, color='white', edgecolor='black')
+        if points:
+            gdf.plot(ax=self.ax, column=column, cmap=cmap, edgecolor='gray',
+                     linewidth=0.3, markersize=point_sizes(gdf[column]))
+        else:
+            gdf.plot(ax=self.ax, column=column, cmap=cmap, edgecolor='gray')
+        self.collection = self.ax.collections[-1]
+        self.colorbar = self.fig.colorbar(self.collection, cax=cax)
+
+        self.parts = self.patch_rows(gdf, len(self.collection.get_array()))
+
+        self.ax.set_title(title)
+        self.ax.axis('off')
+
+    @staticmethod
+    def patch_rows(gdf, n_patches):
+        """Get the gdf row of every patch in the drawn collection."""
+        """geopandas 1.x draws a multipolygon as one patch and older versions
+        draw one patch per polygon part, so the mapping follows the number
+        of patches actually drawn."""
+        if n_patches == len(gdf):
+            return np.arange(len(gdf))
+        parts = gdf.geometry.reset_index(drop=True)\
+            .explode(index_parts=False).index.to_numpy()
+        if len(parts) != n_patches:
+            raise ValueError(f"The map has {n_patches} patches for "
+                             f"{len(gdf)} msas with {len(parts)} polygon "
+                             "parts, so values cannot be matched to them.")
+        return parts
+
+    def update(self, values, title=None):
+        """Recolor the msas with new values, in the rows order of the gdf."""
+        values = np.asarray(values, dtype=float)
+        self.collection.set_array(values[self.parts])
+        if self.points:
+            self.collection.set_sizes(point_sizes(values))
+        # the colorbar follows the collection limits
+        self.collection.set_clim(np.nanmin(values), np.nanmax(values))
+        if title is not None:
+            self.ax.set_title(title)
+
+    def savefig(self, fname):
+        """Export the current state of the template with the Agg renderer."""
+        self.fig.savefig(fname)
@@ -0,0 +1,147 @@
+# Seasonal Adjustment
+
+###############################################################################
+"""
+In this .py file, we will seasonally adjust the monthly unemployment rates of
+ all MSAs at once, estimating month-of-year effects (and optionally a trend)
+ with grouped matrix operations over an MSA x month array, and cache the
+ adjusted panel for the plots, quartile differences and maps.
+"""
+###############################################################################
+
+# import packages
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+CACHEPATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
+    r'\\msa-brac-employment-spatial\\cache'
+
+# centered 2x12 moving average weights of the classical decomposition
+TREND_WEIGHTS = np.r_[0.5, np.ones(11), 0.5] / 12
+
+# adjusted panels already computed in this process, keyed by input hash
+_PANELS = {}
+
+
+# %% Section 1 Adjustment
+
+def msa_month_array(df, id_column, value_column):
+    """Pivot a long monthly df into an msa x month array."""
+    """Months are counted from January of the first year, so missing months
+    stay as nan columns and the month of year is the column index mod 12."""
+    year = df['year'].astype(int).to_numpy()
+    month = df['month'].astype(int).to_numpy()
+    first_year = year.min()
+    period = (year - first_year) * 12 + month - 1
+
+    ids, row = np.unique(df[id_column].to_numpy(), return_inverse=True)
+    values = np.full((len(ids), period.max() + 1), np.nan)
+    values[row, period] = df[value_column].to_numpy(dtype=float)
+    return ids, first_year, values
+
+
+def moving_average_trend(values):
+    """Centered 2x12 moving average of every row in one matrix product."""
+    """The first and last six months, and windows with a missing month, have
+    no trend and are nan."""
+    trend = np.full(values.shape, np.nan)
+    if values.shape[1] >= len(TREND_WEIGHTS):
+        windows = np.lib.stride_tricks.sliding_window_view(
+            values, len(TREND_WEIGHTS), axis=1)
+        trend[:, 6:-6] = windows @ TREND_WEIGHTS
+    return trend
+
+
+def row_nanmean(values):
+    """Mean of the observed values in each row, nan for empty rows."""
+    observed = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(observed, values, 0).sum(axis=1, keepdims=True)\
+            / observed.sum(axis=1, keepdims=True)
+
+
+def seasonal_factors(values, baseline, months):
+    """Estimate centered month-of-year effects of every msa at once."""
+    """The deviations from baseline are averaged by month of year through a
+    product with a month indicator matrix, then centered to sum to zero."""
+    deviation = values - baseline
+    observed = ~np.isnan(deviation)
+    indicators = np.eye(12)[months]
+    sums = np.where(observed, deviation, 0) @ indicators
+    counts = observed @ indicators
+    with np.errstate(invalid='ignore', divide='ignore'):
+        factors = sums / counts
+    factors = factors - row_nanmean(factors)
+    # months never observed for an msa are left unadjusted
+    return np.nan_to_num(factors)
+
+
+def seasonal_adjust(values, trend=False):
+    """Remove month-of-year effects from every row of an msa x month array."""
+    """Effects are measured around the moving average trend, or around the
+    msa mean when a row is too short or gappy for one. With trend=True the
+    trend is removed as well, keeping each msa's mean level, which leaves
+    the first and last six months as nan."""
+    months = np.arange(values.shape[1]) % 12
+    mean = row_nanmean(values)
+    baseline = moving_average_trend(values)
+    no_trend = np.isnan(baseline).all(axis=1)
+    baseline[no_trend] = mean[no_trend]
+
+    factors = seasonal_factors(values, baseline, months)
+    adjusted = values - factors[:, months]
+    if trend:
+        adjusted = adjusted - baseline + mean
+    return adjusted
+
+
+# %% Section 2 Cached Panels
+
+def adjusted_panel(df, id_column, value_column, trend=False,
+                   cache_dir=CACHEPATH):
+    """Get the seasonally adjusted long panel, computing it only once."""
+    """Panels are cached in memory and in cache_dir under a hash of the
+    input values, so the plots, quartile differences and maps share one
+    computation. The panel has the id, year, month and adjusted columns."""
+    inputs = df[[id_column, 'year', 'month', value_column]].astype(
+        {'year': int, 'month': int})
+    sha = hashlib.sha256(pd.util.hash_pandas_object(inputs, index=False)
+                         .to_numpy().tobytes())
+    sha.update(f'{id_column}|{value_column}|{trend}'.encode())
+    key = sha.hexdigest()[:16]
+    if key in _PANELS:
+        return _PANELS[key]
+
+    cache_file = os.path.join(cache_dir, f'seasonal_{key}.pkl')
+    if os.path.exists(cache_file):
+        panel = pd.read_pickle(cache_file)
+    else:
+        ids, first_year, values = msa_month_array(inputs, id_column,
+                                                  value_column)
+        adjusted = seasonal_adjust(values, trend)
+        # back to long format, keeping only the observed msa-months
+        rows, periods = np.nonzero(~np.isnan(values))
+        panel = pd.DataFrame({id_column: ids[rows],
+                              'year': first_year + periods // 12,
+                              'month': periods % 12 + 1,
+                              'adjusted': adjusted[rows, periods]})
+        os.makedirs(cache_dir, exist_ok=True)
+        panel.to_pickle(cache_file)
+
+    _PANELS[key] = panel
+    return panel
+
+
+def add_adjusted_column(df, id_column, value_column, adjusted_column,
+                        trend=False):
+    """Add the seasonally adjusted value_column to df as adjusted_column."""
+    panel = adjusted_panel(df, id_column, value_column, trend)
+    keys = df[[id_column, 'year', 'month']].astype({'year': int,
+                                                   'month': int})
+    # a left merge keeps the rows of df in order
+    merged = keys.merge(panel, on=[id_column, 'year', 'month'], how='left')
+    df[adjusted_column] = merged['adjusted'].to_numpy()
+    return df
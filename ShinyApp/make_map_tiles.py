@@ -0,0 +1,70 @@
+# Map Tiles
+
+###############################################################################
+"""
+In this .py file, we will precompute the CBSA and state geometries of the
+ Shiny app map offline: one simplified, quantized GeoJSON per layer and zoom
+ level, so the app only reads small files and the browser gets only the
+ detail each zoom level can show.
+"""
+###############################################################################
+
+# import packages
+import os
+import shapely
+import geopandas
+
+
+PATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
+    r'\\msa-brac-employment-spatial'
+GEOPATH = os.path.join(os.path.dirname(__file__), 'my_app', 'geo')
+
+# zoom levels with their own detail, the app uses the closest level below
+# its current zoom
+TILE_ZOOMS = [3, 5, 7]
+# TIGER shapefile, feature id and kept property of each layer
+LAYERS = {'cbsa': (('tl_2019_us_cbsa', 'tl_2019_us_cbsa.shp'), 'CBSAFP',
+                   'NAME'),
+          'state': (('cb_2018_us_state_5m', 'cb_2018_us_state_5m.shp'),
+                    'STUSPS', 'NAME')}
+
+
+def grid_size(zoom):
+    """Coordinate grid in degrees, a bit under one screen pixel at zoom."""
+    """A 256 pixel tile spans 360 / 2**zoom degrees of longitude, and a power
+    of two grid keeps the written coordinates short."""
+    return 2.0 ** -zoom
+
+
+def read_layer(folder, shp_file, id_column, name_column):
+    """Read a TIGER shapefile in leaflet's coordinates, indexed by id."""
+    gdf = geopandas.read_file(os.path.join(PATH, folder, shp_file))
+    gdf = gdf.to_crs(epsg=4326)[[id_column, name_column, 'geometry']]
+    return gdf.set_index(id_column)
+
+
+def tile(gdf, zoom):
+    """Simplify and quantize the geometries for one zoom level."""
+    """Coordinates are snapped point by point, so small msas keep a shape
+    instead of collapsing to an empty geometry."""
+    size = grid_size(zoom)
+    geoms = gdf.geometry.simplify(size, preserve_topology=True).to_numpy()
+    return gdf.set_geometry(shapely.set_precision(geoms, size,
+                                                  mode='pointwise'),
+                            crs=gdf.crs)
+
+
+def write_tiles(layers=LAYERS, zooms=TILE_ZOOMS, geo_dir=GEOPATH):
+    """Write geo_dir/{layer}_z{zoom}.geojson for every layer and zoom."""
+    os.makedirs(geo_dir, exist_ok=True)
+    for layer, (shp, id_column, name_column) in layers.items():
+        gdf = read_layer(*shp, id_column, name_column)
+        for zoom in zooms:
+            fname = os.path.join(geo_dir, f'{layer}_z{zoom}.geojson')
+            # the index becomes the feature id the app colors by
+            with open(fname, 'w') as f:
+                f.write(tile(gdf, zoom).to_json(drop_id=False))
+
+
+if __name__ == '__main__':
+    write_tiles()
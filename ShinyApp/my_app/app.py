@@ -4,52 +4,27 @@
 from shiny import App, render, ui, reactive
 import pandas as pd
 import os
+import sys
+import json
 import numpy as np
-import datetime
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+from functools import lru_cache
+from ipyleaflet import Map, GeoJSON
+from branca.colormap import linear
+from shinywidgets import output_widget, render_widget, reactive_read
 
 
 PATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
     r'\\msa-brac-employment-spatial\\ShinyApp'
-DATAPATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
-    r'\\msa-brac-employment-spatial\\Data'
-
-
-# prepare data for shiny
-def load_file(fname, ftype, skiprows, skipfooter, na_values, remains, yr_str):
-    """Read csv and excel files with necessary cleaning steps."""
-    """Includes skip rows/footers, identify nas, keep required columns,
-    remove spaces in column names, modify year column."""
-    if ftype == "csv":
-        dfname = pd.read_csv(os.path.join(DATAPATH, fname),
-                             skiprows=skiprows,
-                             skipfooter=skipfooter,
-                             engine='python',
-                             na_values=na_values)
-    elif ftype == "excel":
-        dfname = pd.read_excel(os.path.join(DATAPATH, fname),
-                               skiprows=skiprows,
-                               skipfooter=skipfooter,
-                               na_values=na_values)
-    dfname = dfname[remains].copy()
-
-    # remove spaces in column names and make all column names lower-case
-    dfname.columns = [c.strip() for c in dfname.columns]
-    dfname.columns = dfname.columns.str.lower()
-
-    # make year column into integer-like strings for merging purposes
-    if (("year" in dfname.columns) & ("month" in dfname.columns)):
-        dfname['year'] = dfname['year'].astype(int)
-        dfname['month'] = dfname['month'].astype(int)
-        dfname['datetime'] = dfname.apply(lambda row:
-                                          datetime.datetime(row['year'],
-                                                            row['month'], 1),
-                                          axis=1)
-    if ("year" in dfname.columns) & (yr_str is True):
-        dfname['year'] = dfname['year'].astype(str)
-
-    return dfname
+# simplified geometries written offline by ShinyApp/make_map_tiles.py, one
+# file per layer and zoom level in MAP_ZOOMS
+GEOPATH = os.path.join(os.path.dirname(__file__), 'geo')
+MAP_ZOOMS = [3, 5, 7]
+
+# share the data loader and figure templates kept at the repository root
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from DataLoader import load_all  # noqa: E402
+from FigureTemplates import get_template, LineTemplate  # noqa: E402
+from app_data import SOURCE_JOBS  # noqa: E402
 
 
 def calculate_share(df, category, share_column):
@@ -93,46 +68,58 @@ def calculate_share_quantiles(df, share_column, year):
     return msa_yr
 
 
+def add_quantile_column(df, share_column, quantile_column):
+    """Label every row with its year's share quantile, as in the plot."""
+    df[quantile_column] = ''
+    for year in df['year'].unique():
+        msa_yr = calculate_share_quantiles(df, share_column, year)
+        df.loc[msa_yr.index, quantile_column] = msa_yr['quantile']
+    return df
+
+
+def build_sort_index(df, columns):
+    """Precompute the ascending row order of df for each sortable column."""
+    return {column: df[column].sort_values(kind='mergesort',
+                                           na_position='last')
+            .index.to_numpy() for column in columns}
+
+
+def build_filter_masks(df, columns):
+    """Precompute a boolean row mask for every value of each filter."""
+    return {(column, value): (df[column] == value).to_numpy()
+            for column in columns for value in df[column].unique()}
+
+
+def table_page(df, rows, columns, page, page_size):
+    """Select one page of rows with only the visible columns."""
+    """Returns the page, the page number clamped to the valid range and
+    the number of pages."""
+    n_pages = max(1, -(-len(rows) // page_size))
+    page = min(max(page, 1), n_pages)
+    visible = rows[(page - 1) * page_size:page * page_size]
+    positions = [df.columns.get_loc(column) for column in columns]
+    return df.iloc[visible, positions], page, n_pages
+
+
+@lru_cache(maxsize=None)
+def load_tile(layer, zoom):
+    """Read a precomputed GeoJSON layer once per server process."""
+    with open(os.path.join(GEOPATH, f'{layer}_z{zoom}.geojson')) as f:
+        return json.load(f)
+
+
+def tile_zoom(zoom):
+    """Most detailed precomputed level not finer than the map zoom."""
+    return max([z for z in MAP_ZOOMS if z <= zoom], default=MAP_ZOOMS[0])
+
+
 # run the above functions
-# preparing the county-level BEA data
-bea = load_file('Table.csv', 'csv', 3, 13, ['(D)', '(NA)'],
-                ['GeoFips', 'Description', '2005', '2006', '2007'],
-                True)
-# preparing the MSA-level BLS data
-msa_bls = load_file('ssamatab1.xlsx', 'excel', [0, 1, 3], 5, ['(n)'],
-                    ['Area FIPS Code', 'Area', 'Year', 'Month',
-                     'Unemployment Rate'], True)
-# preparing the county-MSA crosswalk
-crosswalk = load_file('geocorr2018_2327800015.csv', 'csv', [1], 0, '-',
-                      ['county', 'cbsa10', 'cntyname', 'cbsaname10'], False)
-
-# transform bea into long (tidy) format to be ready for merging
-# and add column "total" as sum of manufactuing and military jobs
-bea = bea.melt(id_vars=['geofips', 'description'],
-               var_name='year', value_name='Value')
-bea = bea.pivot(index=['geofips', 'year'], columns='description',
-                values='Value').reset_index()
-bea.columns = [c.strip() for c in bea.columns]
-bea['total'] = bea['Manufacturing'] + bea['Military']
-# rename columns to follow style guide
-bea.rename(columns={'Manufacturing': 'manufacturing',
-                    'Military': 'military',
-                    'geofips': 'county_code'}, inplace=True)
-bea = bea.dropna()
-
-# rename columns and clean msas for merging purposes
-msa_bls.rename(columns={'area': 'msa',
-                        'unemployment rate': 'unemployment_rate',
-                        'area fips code': 'msa_code'}, inplace=True)
-msa_bls_selected = msa_bls[msa_bls['year'].isin(['2005', '2006',
-                                                 '2007'])]
-
-# modify county and msa columns to match with the other dataframes
-# add comma inbetween state and county to match with msa county column
-crosswalk = crosswalk[(crosswalk['cbsaname10'] != '99999')]
-crosswalk.rename(columns={'county': 'county_code', 'cntyname': 'county',
-                          'cbsaname10': 'msa',
-                          'cbsa10': 'msa_code'}, inplace=True)
+# the three sources parse while holding the GIL, so they load in worker
+# processes, which need the stages from the importable app_data module
+sources = load_all(SOURCE_JOBS, executor='process')
+bea = sources['bea']
+msa_bls_selected = sources['msa_bls']
+crosswalk = sources['crosswalk']
 
 # inner merge bea and crosswalk first
 bea_crosswalk = bea.merge(crosswalk, on='county_code', how='inner')
@@ -153,6 +140,69 @@ bea_bls = bea_crosswalk.merge(msa_bls_selected, on=['msa_code', 'year'],
 bea_bls = fix_na(bea_bls, 'Military Share')
 bea_bls = fix_na(bea_bls, 'Manufacturing Share')
 
+# msa shares by year for the map, with codes matching the CBSA feature ids
+map_shares = bea_crosswalk.reset_index()
+map_shares['msa_code'] = map_shares['msa_code'].astype(int).astype(str)
+
+
+@lru_cache(maxsize=16)
+def map_values(year, share_column):
+    """Share of every msa in year, keyed by CBSA code."""
+    msa_yr = map_shares[map_shares['year'] == year]\
+        .dropna(subset=[share_column])
+    return dict(zip(msa_yr['msa_code'], msa_yr[share_column]))
+
+
+@lru_cache(maxsize=32)
+def styled_tile(zoom, year, share_column):
+    """CBSA features of a zoom level colored by the share of each msa."""
+    """Features are shallow copies that share the cached geometries and
+    only carry a new fill color, which the map applies per feature."""
+    values = map_values(year, share_column)
+    colormap = linear.YlOrRd_09.scale(min(values.values()),
+                                      max(values.values()))
+    tile = load_tile('cbsa', zoom)
+    features = [dict(feature, properties=dict(
+        feature['properties'],
+        style={'fillColor': colormap(values[feature['id']])
+               if feature['id'] in values else 'lightgray'}))
+        for feature in tile['features']]
+    return dict(tile, features=features)
+
+
+# prepare the table once: quantile labels per category, sort orders and
+# filter masks, so each request only slices the rows of the visible page
+TABLE_QUANTILES = {'military': ('Military Share', 'Military Quantile'),
+                   'manufacturing': ('Manufacturing Share',
+                                     'Manufacturing Quantile')}
+TABLE_COLUMNS = ['msa_code', 'msa', 'year', 'month', 'unemployment_rate',
+                 'unemployment_rate_sa']
+table_df = bea_bls.reset_index(drop=True)
+for share_column, quantile_column in TABLE_QUANTILES.values():
+    table_df = add_quantile_column(table_df, share_column, quantile_column)
+table_sort_index = build_sort_index(
+    table_df, TABLE_COLUMNS + [share for share, _ in
+                               TABLE_QUANTILES.values()])
+table_masks = build_filter_masks(
+    table_df, ['year'] + [quantile for _, quantile in
+                          TABLE_QUANTILES.values()])
+
+
+@lru_cache(maxsize=64)
+def filtered_rows(year, category, quantile, sort_by, descending):
+    """Row positions passing the filters, in sort order."""
+    """Cached, so moving between pages of the same view only slices."""
+    order = table_sort_index[sort_by]
+    if descending:
+        order = order[::-1]
+    mask = np.ones(len(table_df), dtype=bool)
+    if year != 'All':
+        mask &= table_masks.get(('year', year), False)
+    if quantile != 'All':
+        quantile_column = TABLE_QUANTILES[category][1]
+        mask &= table_masks.get((quantile_column, quantile), False)
+    return order[mask[order]]
+
 
 # UI components
 app_ui = ui.page_fluid(
@@ -172,8 +222,39 @@ app_ui = ui.page_fluid(
                                             label='Please pick a category',
                                             choices=['manufacturing',
                                                      'military']), offset=4),
+               ui.column(4, ui.input_checkbox(id='seasonal',
+                                              label='Seasonally adjusted',
+                                              value=False), offset=4),
                ui.column(4, ui.output_text('if_brac_year'), offset=4)),
-        ui.output_plot("plot_quantiles", width='100%'), border_color='black'))
+        ui.output_plot("plot_quantiles", width='100%'),
+        ui.hr(),
+        ui.output_text('map_title'),
+        output_widget('msa_map'),
+        ui.hr(),
+        ui.row(ui.column(2, ui.input_select(id='table_yr', label='Year',
+                                            choices=['All', '2005', '2006',
+                                                     '2007'])),
+               ui.column(2, ui.input_select(id='table_category',
+                                            label='Category',
+                                            choices=['manufacturing',
+                                                     'military'])),
+               ui.column(2, ui.input_select(id='table_quantile',
+                                            label='Quantile',
+                                            choices=['All', 'Zero',
+                                                     'LowestQuantile',
+                                                     'MiddleQuantile',
+                                                     'TopQuantile'])),
+               ui.column(2, ui.input_select(id='sort_by', label='Sort by',
+                                            choices=TABLE_COLUMNS +
+                                            ['Share'])),
+               ui.column(1, ui.input_checkbox(id='descending',
+                                              label='Descending')),
+               ui.column(1, ui.input_select(id='page_size', label='Rows',
+                                            choices=['25', '50', '100'])),
+               ui.column(2, ui.input_numeric(id='page', label='Page',
+                                             value=1, min=1))),
+        ui.output_text('table_pages'),
+        ui.output_table('make_table'), border_color='black'))
 
 
 # Server
@@ -203,10 +284,74 @@ def server(input, output, session):
         year = input.yr()
         return year
 
+    @reactive.Calc
+    def get_rate_name():
+        rate = 'unemployment_rate_sa' if input.seasonal()\
+            else 'unemployment_rate'
+        return rate
+
+    @output
+    @render.text
+    def map_title():
+        return f'{get_column_name()} by MSA, {get_yr_name()}'
+
+    @output
+    @render_widget
+    def msa_map():
+        """Build the map once per session, update_map restyles it."""
+        m = Map(center=(38, -96), zoom=4, scroll_wheel_zoom=True)
+        m.add(GeoJSON(data=load_tile('state', tile_zoom(m.zoom)),
+                      style={'color': 'black', 'weight': 1,
+                             'fillOpacity': 0}))
+        # read the inputs without depending on them, so changing them
+        # restyles this map instead of building a new one
+        with reactive.isolate():
+            m.add(GeoJSON(data=styled_tile(tile_zoom(m.zoom), get_yr_name(),
+                                           get_column_name()),
+                          style={'color': 'gray', 'weight': 0.5,
+                                 'fillOpacity': 0.8}))
+        return m
+
+    @reactive.Effect
+    def update_map():
+        """Send the msa colors and the geometry detail of the zoom."""
+        """Each layer gets at most one data update, and assigning the same
+        cached collection again, when the zoom stays within a level of
+        MAP_ZOOMS and the inputs are unchanged, sends nothing."""
+        m = msa_map.widget
+        if m is None:
+            return
+        zoom = tile_zoom(reactive_read(m, 'zoom'))
+        states, msas = m.layers[1:]
+        with m.hold_sync():
+            states.data = load_tile('state', zoom)
+            msas.data = styled_tile(zoom, get_yr_name(), get_column_name())
+
+    @reactive.Calc
+    def get_table_page():
+        """Serialize only the visible page and the selected category."""
+        share_column, quantile_column = \
+            TABLE_QUANTILES[input.table_category()]
+        sort_by = share_column if input.sort_by() == 'Share'\
+            else input.sort_by()
+        rows = filtered_rows(input.table_yr(), input.table_category(),
+                             input.table_quantile(), sort_by,
+                             input.descending())
+        page, page_number, n_pages = table_page(
+            table_df, rows, TABLE_COLUMNS + [share_column, quantile_column],
+            int(input.page() or 1), int(input.page_size()))
+        return page, page_number, n_pages, len(rows)
+
+    @output
+    @render.text
+    def table_pages():
+        _, page_number, n_pages, n_rows = get_table_page()
+        return f'Page {page_number} of {n_pages}, {n_rows} rows'
+
     @output
     @render.table
     def make_table():
-        return bea_bls
+        return get_table_page()[0]
 
     @output
     @render.plot(alt="A line plot")
@@ -224,51 +369,34 @@ def server(input, output, session):
         middle_quant = msa_yr[msa_yr['quantile'] == "MiddleQuantile"]
         top_quant = msa_yr[msa_yr['quantile'] == "TopQuantile"]
 
-        zero_mean = zero.groupby('datetime')['unemployment_rate'].mean()
-        low_quant_mean = low_quant.groupby('datetime')['unemployment_rate']\
-            .mean()
-        middle_quant_mean = middle_quant.groupby('datetime')\
-            ['unemployment_rate'].mean()
-        top_quant_mean = top_quant.groupby('datetime')['unemployment_rate']\
-            .mean()
-        # plot the graph for four lines
-        fig, ax = plt.subplots(figsize=(8, 6))
-        ax.plot(zero_mean.index, zero_mean, 'r-', label='Zero')
-        ax.plot(low_quant_mean.index, low_quant_mean, 'y-',
-                label='Lowest Quantile')
-        ax.plot(middle_quant_mean.index, middle_quant_mean, 'g-',
-                label='Middle Quantile')
-        ax.plot(top_quant_mean.index, top_quant_mean, 'b-',
-                label='Top Quantile')
+        rate = get_rate_name()
+        zero_mean = zero.groupby('datetime')[rate].mean()
+        low_quant_mean = low_quant.groupby('datetime')[rate].mean()
+        middle_quant_mean = middle_quant.groupby('datetime')[rate].mean()
+        top_quant_mean = top_quant.groupby('datetime')[rate].mean()
+        # build the figure once per server process and only update lines,
+        # brac markers and title on later renders, outside of pyplot so
+        # shiny closing the rendered figure does not discard the template
+        template = get_template(('quantiles',), lambda: LineTemplate(
+            ['Zero', 'Lowest Quantile', 'Middle Quantile', 'Top Quantile'],
+            ['r-', 'y-', 'g-', 'b-'], figsize=(8, 6), managed=False))
 
         # plot BRAC start and end vertical lines with annotations if year=2005
-        # get the best vertical position for BRAC start and BRAC end
-        text_position = min(pd.concat([zero_mean, low_quant_mean,
-                                       middle_quant_mean, top_quant_mean],
-                                      ignore_index=True))
+        brac_window = None
         if input.yr() == '2005':
-            ax.axvline(pd.to_datetime(f'{input.yr()}-05-01'), color='k',
-                       linestyle=':')
-            ax.axvline(pd.to_datetime(f'{input.yr()}-09-01'), color='k',
-                       linestyle=':')
-            ax.annotate(text='BRAC start', xy=(pd.to_datetime('2005-05-01'),
-                                               text_position))
-            ax.annotate(text='BRAC end', xy=(pd.to_datetime('2005-09-01'),
-                                             text_position))
-
-        # format month on the x-axis
-        ax.xaxis.set_major_locator(mdates.MonthLocator())
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-        plt.xticks(rotation=45)
-
-        # add relevant labels and titles
-        ax.legend(loc='best')
-        ax.set_ylabel('Unemployment rate (%)')
-        ax.set_xlabel('Date')
-        ax.set_title(f'Average Unemp Rate by {column} Quantiles, {input.yr()}')
+            brac_window = (pd.to_datetime('2005-05-01'),
+                           pd.to_datetime('2005-09-01'))
+        template.update({'Zero': zero_mean,
+                         'Lowest Quantile': low_quant_mean,
+                         'Middle Quantile': middle_quant_mean,
+                         'Top Quantile': top_quant_mean},
+                        f'Average Unemp Rate by {column} Quantiles, '
+                        f'{input.yr()}' + (', Seasonally Adjusted'
+                                           if input.seasonal() else ''),
+                        brac_window)
 
         # show graph
-        return fig
+        return template.fig
 
 
 app = App(app_ui, server, debug=True)
@@ -0,0 +1,111 @@
+# Shiny App Data
+
+###############################################################################
+"""
+In this .py file, we will keep the loading and cleaning stages of the Shiny
+ app in an importable module, so the app can run them in worker processes.
+"""
+###############################################################################
+
+# import packages
+import pandas as pd
+import os
+import sys
+import datetime
+
+
+DATAPATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
+    r'\\msa-brac-employment-spatial\\Data'
+
+# share the seasonal adjustment kept at the repository root
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from SeasonalAdjustment import add_adjusted_column  # noqa: E402
+
+
+def load_file(fname, ftype, skiprows, skipfooter, na_values, remains, yr_str):
+    """Read csv and excel files with necessary cleaning steps."""
+    """Includes skip rows/footers, identify nas, keep required columns,
+    remove spaces in column names, modify year column."""
+    if ftype == "csv":
+        dfname = pd.read_csv(os.path.join(DATAPATH, fname),
+                             skiprows=skiprows,
+                             skipfooter=skipfooter,
+                             engine='python',
+                             na_values=na_values)
+    elif ftype == "excel":
+        dfname = pd.read_excel(os.path.join(DATAPATH, fname),
+                               skiprows=skiprows,
+                               skipfooter=skipfooter,
+                               na_values=na_values)
+    dfname = dfname[remains].copy()
+
+    # remove spaces in column names and make all column names lower-case
+    dfname.columns = [c.strip() for c in dfname.columns]
+    dfname.columns = dfname.columns.str.lower()
+
+    # make year column into integer-like strings for merging purposes
+    if (("year" in dfname.columns) & ("month" in dfname.columns)):
+        dfname['year'] = dfname['year'].astype(int)
+        dfname['month'] = dfname['month'].astype(int)
+        dfname['datetime'] = dfname.apply(lambda row:
+                                          datetime.datetime(row['year'],
+                                                            row['month'], 1),
+                                          axis=1)
+    if ("year" in dfname.columns) & (yr_str is True):
+        dfname['year'] = dfname['year'].astype(str)
+
+    return dfname
+
+
+def reshape_bea(bea):
+    """Reshape county BEA jobs to long format with a total column."""
+    # transform bea into long (tidy) format to be ready for merging
+    # and add column "total" as sum of manufactuing and military jobs
+    bea = bea.melt(id_vars=['geofips', 'description'],
+                   var_name='year', value_name='Value')
+    bea = bea.pivot(index=['geofips', 'year'], columns='description',
+                    values='Value').reset_index()
+    bea.columns = [c.strip() for c in bea.columns]
+    bea['total'] = bea['Manufacturing'] + bea['Military']
+    # rename columns to follow style guide
+    bea.rename(columns={'Manufacturing': 'manufacturing',
+                        'Military': 'military',
+                        'geofips': 'county_code'}, inplace=True)
+    return bea.dropna()
+
+
+def clean_bls(msa_bls):
+    """Rename BLS columns and keep the BEA years."""
+    """The seasonally adjusted rate is estimated from all years first."""
+    # rename columns and clean msas for merging purposes
+    msa_bls.rename(columns={'area': 'msa',
+                            'unemployment rate': 'unemployment_rate',
+                            'area fips code': 'msa_code'}, inplace=True)
+    msa_bls = add_adjusted_column(msa_bls, 'msa_code', 'unemployment_rate',
+                                  'unemployment_rate_sa')
+    return msa_bls[msa_bls['year'].isin(['2005', '2006', '2007'])]
+
+
+def clean_crosswalk(crosswalk):
+    """Keep counties in an msa and rename codes to match the other data."""
+    # modify county and msa columns to match with the other dataframes
+    crosswalk = crosswalk[(crosswalk['cbsaname10'] != '99999')]
+    return crosswalk.rename(columns={'county': 'county_code',
+                                     'cntyname': 'county',
+                                     'cbsaname10': 'msa',
+                                     'cbsa10': 'msa_code'})
+
+
+# the county-level BEA data, MSA-level BLS data and county-MSA crosswalk are
+# independent, each (load, args, stage) job runs in its own worker
+SOURCE_JOBS = {
+    'bea': (load_file, ('Table.csv', 'csv', 3, 13, ['(D)', '(NA)'],
+                        ['GeoFips', 'Description', '2005', '2006', '2007'],
+                        True), reshape_bea),
+    'msa_bls': (load_file, ('ssamatab1.xlsx', 'excel', [0, 1, 3], 5,
+                            ['(n)'], ['Area FIPS Code', 'Area', 'Year',
+                                      'Month', 'Unemployment Rate'], True),
+                clean_bls),
+    'crosswalk': (load_file, ('geocorr2018_2327800015.csv', 'csv', [1], 0,
+                              '-', ['county', 'cbsa10', 'cntyname',
+                                    'cbsaname10'], False), clean_crosswalk)}
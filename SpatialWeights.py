@@ -0,0 +1,222 @@
+# Spatial Weights
+
+###############################################################################
+"""
+In this .py file, we will build sparse neighbor weights between MSAs from the
+ CBSA shapefile, and compute spatial lags (spillovers) of BRAC direct effects
+ and monthly MSA unemployment rates.
+"""
+###############################################################################
+
+# import packages
+import os
+import numpy as np
+import pandas as pd
+import geopandas
+import shapely
+from scipy import sparse
+from SeasonalAdjustment import add_adjusted_column
+from Visualizations import old_new
+
+
+PATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
+    r'\\msa-brac-employment-spatial'
+DATAPATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
+    r'\\msa-brac-employment-spatial\\Data'
+CACHEPATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
+    r'\\msa-brac-employment-spatial\\cache'
+
+# equal-area projection used to measure distances between msas in meters
+DISTANCE_CRS = 'EPSG:5070'
+
+# BLS area codes from here on are New England city and town areas
+NECTA_START = 70000
+
+
+# %% Section 1 Neighbor Weights
+
+def read_shp_file(folder, shp_file):
+    """Read shp file."""
+    shp = os.path.join(PATH, folder, shp_file)
+    shp = geopandas.read_file(shp)
+    return shp
+
+
+def contiguity_pairs(geoms, kind):
+    """Find pairs of touching polygons using an STRtree bulk query."""
+    """Queen neighbors share at least one point, rook neighbors share an edge.
+    Each pair is returned once, with the first index lower than the second."""
+    tree = shapely.STRtree(geoms)
+    # the tree only runs the exact intersects test on bounding box candidates
+    left, right = tree.query(geoms, predicate='intersects')
+    keep = left < right
+    left, right = left[keep], right[keep]
+
+    if kind == 'rook':
+        # rook neighbors need a shared border of positive length, so msas
+        # meeting only at a corner are dropped
+        shared = shapely.intersection(shapely.boundary(geoms[left]),
+                                      shapely.boundary(geoms[right]))
+        keep = shapely.length(shared) > 0
+        left, right = left[keep], right[keep]
+    return left, right
+
+
+def distance_band_pairs(points, threshold):
+    """Find pairs of points within threshold of each other with an STRtree."""
+    tree = shapely.STRtree(points)
+    left, right = tree.query(points, predicate='dwithin', distance=threshold)
+    keep = left < right
+    return left[keep], right[keep]
+
+
+def build_weights(gdf, kind='queen', threshold=None):
+    """Build a row-standardized sparse neighbor matrix for msa polygons."""
+    """kind is 'queen' or 'rook' for contiguity, or 'distance' for all msas
+    whose representative points lie within threshold kilometers."""
+    if kind in ['queen', 'rook']:
+        geoms = np.asarray(gdf.geometry)
+        left, right = contiguity_pairs(geoms, kind)
+    elif kind == 'distance':
+        points = np.asarray(gdf.geometry.to_crs(DISTANCE_CRS)
+                            .representative_point())
+        left, right = distance_band_pairs(points, threshold * 1000)
+    else:
+        raise ValueError(f"Unknown weights kind '{kind}', "
+                         "use 'queen', 'rook' or 'distance'.")
+
+    # make the binary matrix symmetric, then divide each row by its number
+    # of neighbors so a spatial lag is the neighbors' mean
+    n = len(gdf)
+    w = sparse.coo_matrix((np.ones(len(left)), (left, right)), shape=(n, n))
+    w = (w + w.T).tocsr()
+    row_sums = np.asarray(w.sum(axis=1)).ravel()
+    scale = np.divide(1, row_sums, out=np.zeros(n), where=row_sums > 0)
+    return (sparse.diags(scale) @ w).tocsr()
+
+
+def cached_weights(gdf, id_column, kind='queen', threshold=None,
+                   cache_dir=CACHEPATH):
+    """Load neighbor weights from the cache, building and saving on a miss."""
+    """The cached ids are compared with the current ones so a changed
+    shapefile rebuilds the matrix instead of returning misaligned rows."""
+    name = kind if threshold is None else f'{kind}_{threshold}km'
+    w_file = os.path.join(cache_dir, f'weights_{name}.npz')
+    ids_file = os.path.join(cache_dir, f'weights_{name}_ids.npy')
+    # a fixed-width string array, object arrays need pickle to load
+    ids = gdf[id_column].astype(str).to_numpy().astype('U')
+
+    if os.path.exists(w_file) and os.path.exists(ids_file):
+        if np.array_equal(np.load(ids_file), ids):
+            return sparse.load_npz(w_file), ids
+
+    w = build_weights(gdf, kind, threshold)
+    os.makedirs(cache_dir, exist_ok=True)
+    sparse.save_npz(w_file, w)
+    np.save(ids_file, ids)
+    return w, ids
+
+
+# %% Section 2 Spatial Lags
+
+def drop_nectas(df, fips_column):
+    """Drop New England city and town areas, keeping county-based msas."""
+    """NECTA codes start at 70000 and have no CBSA polygon of their own, and
+    their old_new targets already have rows in the BLS table."""
+    return df[df[fips_column].astype(int) < NECTA_START]
+
+
+def msa_month_panel(df, id_column, ids, value_column):
+    """Pivot monthly msa values into an msa x month frame aligned to ids."""
+    duplicated = df.duplicated([id_column, 'datetime'])
+    if duplicated.any():
+        raise ValueError(f"{duplicated.sum()} rows repeat an "
+                         f"({id_column}, datetime) pair, so the panel would "
+                         "average different areas.")
+    panel = df.pivot(index=id_column, columns='datetime',
+                     values=value_column)
+    return panel.reindex(ids)
+
+
+def spatial_lag(w, values):
+    """Compute the spatial lag of every column of values in one product."""
+    """Missing values are left out and the remaining neighbor weights are
+    rescaled, msas without observed neighbors get nan."""
+    values = np.asarray(values, dtype=float)
+    one_column = values.ndim == 1
+    if one_column:
+        values = values[:, None]
+
+    # stack the zero-filled values next to the observed mask so the lags and
+    # their weight totals come from a single sparse product
+    observed = ~np.isnan(values)
+    stacked = np.hstack([np.where(observed, values, 0), observed])
+    product = w @ stacked
+    k = values.shape[1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lag = product[:, :k] / product[:, k:]
+
+    return lag[:, 0] if one_column else lag
+
+
+def spillover_frame(ids, direct, unemp_panel, w):
+    """Combine direct effects, unemployment and their lags in one msa df."""
+    """direct is stacked as the first column of the msa x month matrix, so
+    all lags come from a single sparse product."""
+    unemp = unemp_panel.to_numpy(dtype=float)
+    lag = spatial_lag(w, np.column_stack([direct, unemp]))
+    n_ids, n_months = unemp.shape
+
+    # long format with one row per msa-month, like the other panels
+    return pd.DataFrame({
+        'msa_fips': np.repeat(np.asarray(ids), n_months),
+        'datetime': np.tile(unemp_panel.columns.to_numpy(), n_ids),
+        'unemployment_rate': unemp.ravel(),
+        'unemployment_rate_lag': lag[:, 1:].ravel(),
+        'direct': np.repeat(np.asarray(direct, dtype=float), n_months),
+        'direct_lag': np.repeat(lag[:, 0], n_months)})
+
+
+# %% Section 3 Spillovers
+
+if __name__ == '__main__':
+    # load msa polygons and build queen contiguity weights
+    msa_shp = read_shp_file('tl_2019_us_cbsa', 'tl_2019_us_cbsa.shp')
+    w_queen, msa_ids = cached_weights(msa_shp, 'CBSAFP', 'queen')
+
+    # sum brac direct effects per msa with the new fips codes, msas without
+    # a brac action have no direct change
+    brac = pd.read_csv(os.path.join(DATAPATH, 'hw2_data.csv'),
+                       na_values='-')
+    brac = brac.dropna(subset=['msa_fips'])
+    brac['msa_fips'] = brac['msa_fips'].replace(old_new)\
+        .astype(int).astype(str)
+    direct = brac.groupby('msa_fips')['direct'].sum()\
+        .reindex(msa_ids).fillna(0).to_numpy()
+
+    # load monthly msa unemployment rates, seasonally adjusted so seasonal
+    # swings do not spill over, old_new only re-keys brac codes, the BLS
+    # table already uses the CBSA codes of the polygons
+    msa_bls = pd.read_excel(os.path.join(DATAPATH, 'ssamatab1.xlsx'),
+                            skiprows=[0, 1, 3], skipfooter=5,
+                            na_values=['(n)'])
+    msa_bls.columns = [c.strip().lower() for c in msa_bls.columns]
+    msa_bls = drop_nectas(msa_bls, 'area fips code').copy()
+    msa_bls = add_adjusted_column(msa_bls, 'area fips code',
+                                  'unemployment rate', 'unemployment rate sa')
+    msa_bls['msa_fips'] = msa_bls['area fips code'].astype(int).astype(str)
+    msa_bls['datetime'] = pd.to_datetime(dict(year=msa_bls['year'],
+                                              month=msa_bls['month'], day=1))
+    unemp_panel = msa_month_panel(msa_bls, 'msa_fips', msa_ids,
+                                  'unemployment rate sa')
+
+    # spillovers for every msa and month
+    spillover = spillover_frame(msa_ids, direct, unemp_panel, w_queen)
+    print(spillover.head())
+
+    # rook contiguity and a 100km distance band as robustness checks
+    w_rook, _ = cached_weights(msa_shp, 'CBSAFP', 'rook')
+    w_band, _ = cached_weights(msa_shp, 'CBSAFP', 'distance', threshold=100)
+    print('Mean neighbors per msa (queen, rook, 100km band):',
+          [float(np.mean(np.diff(w.indptr))) for w in [w_queen, w_rook,
+                                                       w_band]])
@@ -0,0 +1,104 @@
+# Validation
+
+###############################################################################
+"""
+In this .py file, we will validate frames after each load and merge:
+ declared schemas, key uniqueness, referential coverage between BEA
+ counties, crosswalk counties, BLS MSAs and BRAC msa_fips, and rows dropped,
+ collected in a machine-readable report instead of printed frames.
+"""
+###############################################################################
+
+# import packages
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+REPORTPATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
+    r'\\msa-brac-employment-spatial\\validation'
+
+# dtype kinds accepted in schemas: object/string, integer, float, datetime
+NUMERIC = 'iuf'
+TEXT = 'OSU'
+DATETIME = 'M'
+
+
+class ValidationError(ValueError):
+    """A check failed in a strict validation report."""
+
+
+class ValidationReport:
+    """Collect check results for one pipeline and write them as JSON."""
+    """With strict=True the first failed check writes the report and raises
+    ValidationError, so a broken pipeline stops right after the bad step."""
+
+    def __init__(self, pipeline, strict=True, report_dir=REPORTPATH):
+        self.pipeline = pipeline
+        self.strict = strict
+        self.report_dir = report_dir
+        self.checks = []
+
+    def record(self, check, frame, passed, **details):
+        """Add one check result, raising on failure in strict mode."""
+        self.checks.append({'check': check, 'frame': frame,
+                            'passed': bool(passed), **details})
+        if self.strict and not passed:
+            path = self.write()
+            raise ValidationError(f"{self.pipeline}: {check} failed on "
+                                  f"{frame}, see {path}")
+
+    def check_schema(self, df, frame, schema):
+        """Check df has the declared columns with the declared dtype kinds."""
+        """schema maps each column to a string of accepted numpy dtype kinds,
+        such as NUMERIC or TEXT."""
+        missing = [column for column in schema if column not in df.columns]
+        wrong = {column: str(df[column].dtype)
+                 for column, kinds in schema.items()
+                 if column in df.columns and df[column].dtype.kind
+                 not in kinds}
+        self.record('schema', frame, not missing and not wrong,
+                    missing_columns=missing, wrong_dtypes=wrong)
+
+    def check_unique(self, df, frame, keys):
+        """Check the key columns identify each row, using row hashes."""
+        hashes = pd.util.hash_pandas_object(df[keys], index=False)
+        duplicated = hashes.duplicated(keep=False).to_numpy()
+        examples = df.loc[duplicated, keys].drop_duplicates().head(5)
+        self.record('unique_keys', frame, not duplicated.any(), keys=keys,
+                    duplicate_rows=int(duplicated.sum()),
+                    examples=examples.astype(str).to_dict('records'))
+
+    def check_coverage(self, values, reference, frame, reference_name,
+                       min_coverage=0.0):
+        """Check the share of distinct values found in the reference keys."""
+        """Coverage below min_coverage fails, the default only reports."""
+        values = pd.unique(pd.Series(values).dropna())
+        reference = pd.unique(pd.Series(reference).dropna())
+        found = np.isin(values, reference)
+        coverage = found.mean() if len(values) else 1.0
+        self.record('coverage', frame, coverage >= min_coverage,
+                    reference=reference_name, distinct=int(len(values)),
+                    uncovered=int((~found).sum()),
+                    coverage=round(float(coverage), 4),
+                    min_coverage=min_coverage,
+                    examples=[str(v) for v in values[~found][:5]])
+
+    def count_dropped(self, before, after, frame, step, max_share=1.0):
+        """Record how many rows a step dropped, failing above max_share."""
+        dropped = len(before) - len(after)
+        share = dropped / len(before) if len(before) else 0.0
+        self.record('dropped_rows', frame, share <= max_share, step=step,
+                    rows_before=len(before), rows_dropped=dropped,
+                    share=round(share, 4), max_share=max_share)
+
+    def write(self):
+        """Write the report to report_dir as pipeline.json."""
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f'{self.pipeline}.json')
+        with open(path, 'w') as f:
+            json.dump({'pipeline': self.pipeline,
+                       'passed': all(c['passed'] for c in self.checks),
+                       'checks': self.checks}, f, indent=2)
+        return path
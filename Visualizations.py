@@ -9,13 +9,19 @@ In this .py file, we will visualize per MSA BRAC 2005 Closure and Realignment
 
 # import packages
 import os
+import numpy as np
 import pandas as pd
 import datetime
+from functools import partial
 import geopandas
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
-import matplotlib.dates as mdates
 from mpl_toolkits.axes_grid1 import make_axes_locatable
+from DataLoader import load_concurrently
+from SeasonalAdjustment import add_adjusted_column
+from Validation import ValidationReport, NUMERIC, TEXT
+from FigureTemplates import get_template, LineTemplate, MapTemplate,\
+    point_sizes
 
 
 PATH = r'C:\\Users\\zhang\\OneDrive\\Documents\\GitHub'\
@@ -70,90 +76,74 @@ def modify_file(fname, year):
     return new_fname
 
 
-# load and modyft msa_blas file
-msa_bls = load_file('ssamatab1.xlsx', 'excel', [0, 1, 3], 5, ['(n)'],
-                    ['Area FIPS Code', 'Area', 'Year', 'Month',
-                     'Unemployment Rate'])
-msa_bls_new = modify_file(msa_bls, 2005)
-
-
 # %%% Sub-Section 1b
 
-# load brac file
-brac = load_file('hw2_data.csv', 'csv', [], 0, '-', ['direct', 'msa_fips'])
-
-
-def group_and_merge(file, columnindex_for_merge):
+def group_and_merge(file, bls_file, columnindex_for_merge):
     """Group by msa_fips and sum direct for each msa, then merge."""
     # find sum of direct per msa
     file = file.dropna(subset=['msa_fips'])
     brac_sum = pd.DataFrame(file.groupby('msa_fips')['direct'].sum())
     # merge the new brac sum with msa_bls
     brac_sum[columnindex_for_merge] = brac_sum.index
-    merged = brac_sum.merge(msa_bls_new, on=columnindex_for_merge,
+    merged = brac_sum.merge(bls_file, on=columnindex_for_merge,
                             how='right')
     # find the no change msas
     merged['direct'] = merged['direct'].fillna(0)
     return brac_sum, merged
 
 
-# get brac_new by msa and merged file of unemployment rate and direct
-brac_new, merged_file = group_and_merge(brac, 'area fips code')
+# %%% Sub-Section 1c
 
+# brac 2005 commission window, from the recommendations in May to the
+# commission report in September
+BRAC_WINDOW = ('05-01', '09-01')
+# the only brac round in the data, other years get no window markers
+BRAC_YEAR = 2005
+# raw and seasonally adjusted unemployment rate columns
+RATE_COLUMNS = {False: 'unemployment rate', True: 'unemployment rate sa'}
 
-# %%% Sub-Section 1c
 
-def plot_gains_losses(file, year):
+def brac_dates(year, brac_window):
+    """Get the BRAC start and end dates of year, None outside BRAC_YEAR."""
+    if brac_window is None or int(year) != BRAC_YEAR:
+        return None
+    return (pd.to_datetime(f'{year}-{brac_window[0]}'),
+            pd.to_datetime(f'{year}-{brac_window[1]}'))
+
+
+def plot_gains_losses(file, year, brac_window=BRAC_WINDOW, fname='plot1.png',
+                      show=True, seasonal=False):
     """Graph the gains, losses, no gains losses curves for a given year."""
+    """With seasonal=True the seasonally adjusted unemployment rate is
+    plotted instead of the raw rate."""
     # create gains, losses, no gains losses subsets, and then group by months
     # to get the mean unemp rate
-    gains = file[merged_file['direct'] > 0]
+    rate = RATE_COLUMNS[seasonal]
+    gains = file[file['direct'] > 0]
     losses = file[file['direct'] < 0]
     no_gains_losses = file[file['direct'] == 0]
-    gains_mean = gains.groupby('datetime')['unemployment rate'].mean()
-    losses_mean = losses.groupby('datetime')['unemployment rate'].mean()
+    gains_mean = gains.groupby('datetime')[rate].mean()
+    losses_mean = losses.groupby('datetime')[rate].mean()
     no_gains_losses_mean = no_gains_losses\
-        .groupby('datetime')['unemployment rate'].mean()
-
-    # get the best vertical position for BRAC start and BRAC end
-    text_position = min(pd.concat([gains_mean, losses_mean,
-                                   no_gains_losses_mean], ignore_index=True))
-
-    # plot the graph for three lines
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.plot(gains_mean.index, gains_mean, 'g-', label='net gains')
-    ax.plot(losses_mean.index, losses_mean, 'r-', label='net losses')
-    ax.plot(no_gains_losses_mean.index, no_gains_losses_mean, 'b-',
-            label='no gains or losses')
-
-    # plot BRAC start and end vertical lines with annotations
-    ax.axvline(pd.to_datetime(f'{year}-05-01'), color='k', linestyle=':')
-    ax.axvline(pd.to_datetime(f'{year}-09-01'), color='k', linestyle=':')
-    ax.annotate(text='BRAC start', xy=(pd.to_datetime(f'{year}-05-01'),
-                                       text_position))
-    ax.annotate(text='BRAC end', xy=(pd.to_datetime(f'{year}-09-01'),
-                                     text_position))
-
-    # format month on the x-axis
-    ax.xaxis.set_major_locator(mdates.MonthLocator())
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-    plt.xticks(rotation=45)
-
-    # add relevant labels and titles
-    ax.legend(loc='best')
-    ax.set_ylabel('Unemployment rate (%)')
-    ax.set_xlabel('Date')
-    ax.set_title('Average Unemp Rate by BRAC Direct Changes Over Time,' +
-                 f' {year}')
+        .groupby('datetime')[rate].mean()
+
+    # build the figure once and only update lines, markers and title on
+    # later calls, windowless calls use a figure pyplot does not track
+    template = get_template(('gains_losses', show), lambda: LineTemplate(
+        ['net gains', 'net losses', 'no gains or losses'],
+        ['g-', 'r-', 'b-'], figsize=(10, 6), managed=show))
+    template.update({'net gains': gains_mean,
+                     'net losses': losses_mean,
+                     'no gains or losses': no_gains_losses_mean},
+                    'Average Unemp Rate by BRAC Direct Changes Over Time,' +
+                    f' {year}' + (', Seasonally Adjusted' if seasonal else ''),
+                    brac_dates(year, brac_window))
 
     # save and show graph
-    plot1 = os.path.join(IMAGEPATH, "plot1.png")
-    fig.savefig(plot1)
-    plt.show()
-
-
-# plot three lines for unemployment rates
-plot_gains_losses(merged_file, 2005)
+    plot1 = os.path.join(IMAGEPATH, fname)
+    template.savefig(plot1)
+    if show:
+        plt.show()
 
 
 # %% Section 2 Choropleth
@@ -186,18 +176,18 @@ def split_continental_and_territory_msas(state, msa):
     return state_conti, state_terri, msa_conti, msa_terri
 
 
-# old fips to new fips mapping
-old_new = {19380: 19660,  # Dayton OH
-           70750: 12700,  # Bangor, ME
-           70900: 12940,  # Barnstable, MA
-           71650: 12700,  # Boston, MA
-           71950: 14860,  # Bridgeport, CT
-           72400: 15540,  # Burlington, VT
-           73450: 25860,  # Hartford, CT
-           75700: 35380,  # New Haven, CT
-           76450: 35980,  # Norwich, CT
-           76750: 38860,  # Portland, ME
-           77200: 39300,  # Providence, RI
+# old fips to new fips mapping of the brac msas, also used by SpatialWeights.py
+old_new = {19380: 19430,  # Dayton, OH
+           70750: 12620,  # Bangor, ME
+           70900: 12700,  # Barnstable Town, MA
+           71650: 14460,  # Boston-Cambridge-Newton, MA-NH
+           71950: 14860,  # Bridgeport-Stamford-Norwalk, CT
+           72400: 15540,  # Burlington-South Burlington, VT
+           73450: 25540,  # Hartford-East Hartford-Middletown, CT
+           75700: 35300,  # New Haven-Milford, CT
+           76450: 35980,  # Norwich-New London, CT
+           76750: 38860,  # Portland-South Portland, ME
+           77200: 39300,  # Providence-Warwick, RI-MA
            78100: 44140}  # Springfield, MA
 
 
@@ -219,42 +209,100 @@ def get_gdf(df):
     return gdf
 
 
-def plot_continentalUS(gdf, edge, column_to_plot):
-    """Create spatial mapping to show the direct affects of BRAC in the US."""
-    fig, ax = plt.subplots(figsize=(9, 6))
-    # define divider, cax
-    divider = make_axes_locatable(ax)
-    cax = divider.append_axes('right', size='5%', pad=0.1)
-    # plot edge and direct data
-    ax = edge.plot(ax=ax, color='white', edgecolor='black', legend=False)
-    ax = gdf.plot(ax=ax, column='direct', cmap='coolwarm', edgecolor='gray',
-                  legend=True, cax=cax)
-    ax.set_title('Non-zero Direct Effects of BRAC, by Continental USA MSA')
-    ax.axis('off');
+# %%% Sub-Section 2b rendering modes for national maps
 
-    # save as png to local
-    plot2 = os.path.join(IMAGEPATH, "plot2.png")
-    fig.savefig(plot2)
+MAP_MODES = ['auto', 'full', 'simplified', 'points']
+# below this median msa size in output pixels, msas are drawn as points
+MIN_POLYGON_PIXELS = 8
 
 
-# Running functions for Q2
-# load and read shp files
-msa_shp = read_shp_file('tl_2019_us_cbsa', 'tl_2019_us_cbsa.shp')
-state_shp = read_shp_file('cb_2018_us_state_5m', 'cb_2018_us_state_5m.shp')
+def add_representative_points(gdf):
+    """Precompute a point inside each msa for the points rendering mode."""
+    gdf['rep_point'] = gdf.geometry.representative_point()
+    return gdf
 
-# split the continental and territory states and msas, also for the extra
-# credit question later
-state_conti, state_terri, msa_conti,\
-    msa_terri = split_continental_and_territory_msas(state_shp, msa_shp)
 
-# get merged msa brac dataframe
-merged_msa_brac_conti = modify_and_merge_fips_brac(msa_conti, brac_new,
-                                                   old_new)
-# get geometry points for continental US msas
-gdf_state_conti = get_gdf(state_conti)
-gdf_msa_conti = get_gdf(merged_msa_brac_conti)
-# plot the state edge and msa dots colored based on the value of direct
-plot_continentalUS(gdf_msa_conti, gdf_state_conti, 'direct')
+def output_dpi():
+    """Resolution of the saved figures."""
+    dpi = plt.rcParams['savefig.dpi']
+    if dpi == 'figure':
+        dpi = plt.rcParams['figure.dpi']
+    return dpi
+
+
+def axes_units_per_pixel(ax, bounds):
+    """Map units per output pixel of ax when it shows bounds."""
+    """bounds is (minx, miny, maxx, maxy), and with equal aspect the longer
+    side relative to the axes fills its size in the saved figure."""
+    minx, miny, maxx, maxy = bounds
+    position = ax.get_position()
+    width, height = ax.figure.get_size_inches() * output_dpi()
+    return max((maxx - minx) / (position.width * width),
+               (maxy - miny) / (position.height * height))
+
+
+def choose_map_mode(mode, gdf, edge, figsize):
+    """Resolve the map rendering mode and the map units per output pixel."""
+    """'auto' draws msas as points when the median msa would be smaller than
+    MIN_POLYGON_PIXELS at the saved figure size and dpi, and as polygons
+    simplified to the pixel size otherwise. 'full' keeps every vertex."""
+    if mode not in MAP_MODES:
+        raise ValueError(f"Unknown map mode '{mode}', use one of "
+                         f"{MAP_MODES}.")
+    dpi = output_dpi()
+    minx, miny, maxx, maxy = edge.total_bounds
+    units_per_pixel = max((maxx - minx) / (figsize[0] * dpi),
+                          (maxy - miny) / (figsize[1] * dpi))
+
+    if mode == 'auto':
+        bounds = gdf.geometry.bounds
+        msa_size = np.sqrt((bounds['maxx'] - bounds['minx'])
+                           * (bounds['maxy'] - bounds['miny']))
+        small = np.median(msa_size) / units_per_pixel < MIN_POLYGON_PIXELS
+        mode = 'points' if small else 'simplified'
+    return mode, units_per_pixel
+
+
+def map_geometry(gdf, mode, units_per_pixel):
+    """Get the msa gdf with geometry for the mode: full, simplified, points."""
+    if mode == 'points':
+        if 'rep_point' not in gdf.columns:
+            gdf = add_representative_points(gdf.copy())
+        return gdf.set_geometry('rep_point')
+    if mode == 'simplified':
+        return map_edges(gdf, mode, units_per_pixel)
+    return gdf
+
+
+def map_edges(edge, mode, units_per_pixel):
+    """Simplify edges to the output resolution unless drawing full detail."""
+    if mode == 'full':
+        return edge
+    # half a pixel of tolerance is not visible in the saved png
+    return edge.set_geometry(edge.geometry.simplify(units_per_pixel / 2))
+
+
+def plot_continentalUS(gdf, edge, column_to_plot, fname='plot2.png',
+                       show=True, mode='auto'):
+    """Create spatial mapping to show the direct affects of BRAC in the US."""
+    """mode is one of MAP_MODES, 'auto' picks points or simplified polygons
+    from the figure size and dpi, 'full' draws the original polygons."""
+    figsize = (9, 6)
+    mode, units_per_pixel = choose_map_mode(mode, gdf, edge, figsize)
+
+    # build the map once per set of msas and mode and recolor it on later
+    # calls
+    key = ('continental', show, mode, tuple(gdf.index), tuple(edge.index))
+    template = get_template(key, lambda: MapTemplate(
+        map_geometry(gdf, mode, units_per_pixel),
+        map_edges(edge, mode, units_per_pixel), column_to_plot,
+        'Non-zero Direct Effects of BRAC, by Continental USA MSA',
+        figsize=figsize, managed=show, points=mode == 'points'))
+    template.update(gdf[column_to_plot])
+
+    # save as png to local
+    plot2 = os.path.join(IMAGEPATH, fname)
+    template.savefig(plot2)
 
 
 # %%% Sub-Section Extra credit question
@@ -274,8 +322,18 @@ def get_single_state_msadata(state_list, state_df, gdf_msa_df):
 
 # create figure with one large continental subplot at the top and three
 # territory state smaller subplots at the bottom
-def plot_all_continents_territories():
+def plot_all_continents_territories(gdf_state_conti, gdf_msa_conti,
+                                    territories, brac_new,
+                                    fname='plot3_allstates.png', show=True,
+                                    mode='auto'):
     """Create a brac plot consisting of subplots for the entire US."""
+    """territories holds the AK, HI and PR edge and msa data in the order
+    returned by get_single_state_msadata. mode is one of MAP_MODES and is
+    resolved from the continental subplot for all four subplots, while each
+    subplot is simplified to the pixel size of its own extent."""
+    ak_edge, ak_msa, hi_edge, hi_msa, pr_edge, pr_msa = territories
+    # the continental subplot takes the top two thirds of the figure
+    mode, _ = choose_map_mode(mode, gdf_msa_conti, gdf_state_conti, (12, 6))
     fig, axs = plt.subplots(3, 3, figsize=(12, 9))  # 3x3 subplots
     plt.subplots_adjust(wspace=0.01, hspace=0.1)
     # combine top 2*3 subplots into one big subplot for continental US
@@ -302,22 +360,36 @@ def plot_all_continents_territories():
     ax3.set_xlim(-164, -152)
     ax3.set_ylim(18, 23)
 
+    # half a pixel differs between subplots, PR is shown at several times
+    # the continental scale, so each one gets the extent it displays
+    extents = [gdf_state_conti.total_bounds, (-178, 46, -125, 73),
+               (-164, 18, -152, 23), pr_edge.total_bounds]
+    pixel_units = [axes_units_per_pixel(ax, extent)
+                   for ax, extent in zip([ax1, ax2, ax3, ax4], extents)]
+
     # plot edge for each subplot
-    ax1 = gdf_state_conti.plot(ax=ax1, color='white', edgecolor='black')
-    ax2 = ak_edge.plot(ax=ax2, color='white', edgecolor='black')
-    ax3 = hi_edge.plot(ax=ax3, color='white', edgecolor='black')
-    ax4 = pr_edge.plot(ax=ax4, color='white', edgecolor='black')
+    edges = [gdf_state_conti, ak_edge, hi_edge, pr_edge]
+    ax1, ax2, ax3, ax4 = [map_edges(edge, mode, units_per_pixel)
+                          .plot(ax=ax, color='white', edgecolor='black')
+                          for edge, ax, units_per_pixel
+                          in zip(edges, [ax1, ax2, ax3, ax4], pixel_units)]
+
+    def plot_msas(ax, msa, units_per_pixel):
+        """Plot brac data as polygons, or points sized on one shared scale."""
+        kwargs = {}
+        if mode == 'points':
+            kwargs = {'linewidth': 0.3,
+                      'markersize': point_sizes(msa['direct'],
+                                                max(abs(vmin), abs(vmax)))}
+        return map_geometry(msa, mode, units_per_pixel)\
+            .plot(ax=ax, column='direct', edgecolor='gray', legend=True,
+                  cmap='coolwarm', vmin=vmin, vmax=vmax, cax=cax, **kwargs)
 
     # plot brac data to each subplot, with black dot edge added
-    ax1 = gdf_msa_conti.plot(ax=ax1, column='direct', edgecolor='gray',
-                             legend=True, cmap='coolwarm',
-                             vmin=vmin, vmax=vmax, cax=cax)
-    ax2 = ak_msa.plot(ax=ax2, column='direct', edgecolor='gray', legend=True,
-                      cmap='coolwarm', vmin=vmin, vmax=vmax, cax=cax)
-    ax3 = hi_msa.plot(ax=ax3, column='direct', edgecolor='gray', legend=True,
-                      cmap='coolwarm', vmin=vmin, vmax=vmax, cax=cax)
-    ax4 = pr_msa.plot(ax=ax4, column='direct', edgecolor='gray', legend=True,
-                      cmap='coolwarm', vmin=vmin, vmax=vmax, cax=cax)
+    ax1 = plot_msas(ax1, gdf_msa_conti, pixel_units[0])
+    ax2 = plot_msas(ax2, ak_msa, pixel_units[1])
+    ax3 = plot_msas(ax3, hi_msa, pixel_units[2])
+    ax4 = plot_msas(ax4, pr_msa, pixel_units[3])
 
     # remove axis for each subplot
     for ax in [ax1, ax2, ax3, ax4]:
@@ -343,20 +415,134 @@ def plot_all_continents_territories():
     ax4.set_title('PR');
 
     # save as png to local
-    plot3_allstates = os.path.join(IMAGEPATH, "plot3_allstates.png")
+    plot3_allstates = os.path.join(IMAGEPATH, fname)
     fig.savefig(plot3_allstates)
-
-
-# get only modified state and msa brac data for territory states
-merged_msa_brac_terri = modify_and_merge_fips_brac(msa_terri, brac_new,
-                                                   old_new)
-gdf_state_terri = get_gdf(state_terri)
-gdf_msa_terri = get_gdf(merged_msa_brac_terri)
-
-# create seperate state and msa brac data for AK, HI, and PR
-ak_edge, ak_msa, hi_edge, hi_msa, pr_edge,\
-    pr_msa = get_single_state_msadata(['AK', 'HI', 'PR'], gdf_state_terri,
-                                      gdf_msa_terri)
-
-# plot the data for all continents and territories
-plot_all_continents_territories()
+    if not show:
+        plt.close(fig)
+
+
+# %% Section 3 Data Preparation
+
+def bls_with_year(msa_bls, year):
+    """Keep all years of msa_bls together with its modified file for year."""
+    """The seasonally adjusted rate is added first, estimated from all
+    years of every msa at once."""
+    msa_bls = add_adjusted_column(msa_bls, 'area fips code',
+                                  'unemployment rate', RATE_COLUMNS[True])
+    return msa_bls, modify_file(msa_bls, year)
+
+
+# declared columns and dtype kinds of the loaded sources
+BLS_SCHEMA = {'area fips code': NUMERIC, 'area': TEXT, 'year': NUMERIC,
+              'month': NUMERIC, 'unemployment rate': NUMERIC,
+              RATE_COLUMNS[True]: NUMERIC}
+BRAC_SCHEMA = {'direct': NUMERIC, 'msa_fips': NUMERIC}
+SHP_SCHEMA = {'CBSAFP': TEXT + NUMERIC, 'NAME': TEXT}
+
+
+def validate_sources(msa_bls, brac, msa_shp):
+    """Check the loaded sources and the BRAC msa codes they share."""
+    """Every BRAC msa must reach a CBSA geometry once its old code is
+    replaced through old_new, otherwise the maps would drop it silently.
+    Returns the report so later checks can be added to it."""
+    report = ValidationReport('visualizations')
+    report.check_schema(msa_bls, 'msa_bls', BLS_SCHEMA)
+    report.check_unique(msa_bls, 'msa_bls', ['area fips code', 'year',
+                                             'month'])
+    report.check_schema(brac, 'brac', BRAC_SCHEMA)
+    report.check_schema(msa_shp, 'msa_shp', SHP_SCHEMA)
+    report.check_unique(msa_shp, 'msa_shp', ['CBSAFP'])
+
+    brac_fips = brac['msa_fips'].dropna().astype(int)
+    report.check_coverage(brac_fips, msa_bls['area fips code'], 'brac',
+                          'msa_bls area fips code')
+    report.check_coverage(brac_fips.replace(old_new).astype(str),
+                          msa_shp['CBSAFP'].astype(str), 'brac',
+                          'msa_shp CBSAFP', min_coverage=1.0)
+    return report
+
+
+def prepare_data(year=2005, extra_jobs=None):
+    """Load and prepare the line plot and choropleth data once."""
+    """Returns a dict of the prepared frames so this script and the batch
+    report can reuse them without reading the source files again. The
+    sources load concurrently in worker processes, together with any
+    extra_jobs in DataLoader's (load, args, stage) form, whose results are
+    returned under their own names."""
+    # msa_bls keeps all years for other brac rounds, and its modification
+    # for the year runs in the worker right after the excel file is read
+    jobs = {'msa_bls': (load_file, ('ssamatab1.xlsx', 'excel', [0, 1, 3], 5,
+                                    ['(n)'], ['Area FIPS Code', 'Area',
+                                              'Year', 'Month',
+                                              'Unemployment Rate']),
+                        partial(bls_with_year, year=year)),
+            'brac': (load_file, ('hw2_data.csv', 'csv', [], 0, '-',
+                                 ['direct', 'msa_fips']), None),
+            'msa_shp': (read_shp_file, ('tl_2019_us_cbsa',
+                                        'tl_2019_us_cbsa.shp'), None),
+            'state_shp': (read_shp_file, ('cb_2018_us_state_5m',
+                                          'cb_2018_us_state_5m.shp'), None)}
+    jobs.update(extra_jobs or {})
+
+    sources = {}
+    for name, frame in load_concurrently(jobs, executor='process'):
+        sources[name] = frame
+        # get brac_new by msa and merged file of unemployment rate and
+        # direct as soon as both files are in, while shapefiles still load
+        if name in ['msa_bls', 'brac'] and {'msa_bls', 'brac'} <= set(sources):
+            msa_bls, msa_bls_new = sources['msa_bls']
+            brac = sources['brac']
+            brac_new, merged_file = group_and_merge(brac, msa_bls_new,
+                                                    'area fips code')
+    msa_shp = sources['msa_shp']
+    state_shp = sources['state_shp']
+    report = validate_sources(msa_bls, brac, msa_shp)
+
+    # split the continental and territory states and msas
+    state_conti, state_terri, msa_conti,\
+        msa_terri = split_continental_and_territory_msas(state_shp, msa_shp)
+
+    # get merged msa brac dataframes and geometry for continental US and
+    # territory msas
+    merged_msa_brac_conti = modify_and_merge_fips_brac(msa_conti, brac_new,
+                                                       old_new)
+    merged_msa_brac_terri = modify_and_merge_fips_brac(msa_terri, brac_new,
+                                                       old_new)
+    report.count_dropped(brac_new, pd.concat([merged_msa_brac_conti,
+                                              merged_msa_brac_terri]),
+                         'merged_msa_brac', 'inner merge on CBSAFP')
+    report.write()
+
+    # with points inside each msa precomputed for the points map mode
+    gdf_state_conti = get_gdf(state_conti)
+    gdf_msa_conti = add_representative_points(get_gdf(merged_msa_brac_conti))
+    gdf_state_terri = get_gdf(state_terri)
+    gdf_msa_terri = add_representative_points(get_gdf(merged_msa_brac_terri))
+
+    # create seperate state and msa brac data for AK, HI, and PR
+    territories = get_single_state_msadata(['AK', 'HI', 'PR'],
+                                           gdf_state_terri, gdf_msa_terri)
+
+    data = {'msa_bls': msa_bls, 'brac': brac, 'brac_new': brac_new,
+            'merged_file': merged_file, 'gdf_state_conti': gdf_state_conti,
+            'gdf_msa_conti': gdf_msa_conti, 'territories': territories}
+    data.update({name: sources[name] for name in extra_jobs or {}})
+    return data
+
+
+# %% Section 4 Run
+
+if __name__ == '__main__':
+    data = prepare_data(2005)
+
+    # plot three lines for unemployment rates
+    plot_gains_losses(data['merged_file'], 2005)
+
+    # plot the state edge and msa dots colored based on the value of direct
+    plot_continentalUS(data['gdf_msa_conti'], data['gdf_state_conti'],
+                       'direct')
+
+    # plot the data for all continents and territories
+    plot_all_continents_territories(data['gdf_state_conti'],
+                                    data['gdf_msa_conti'],
+                                    data['territories'], data['brac_new'])
@@ -0,0 +1,49 @@
+# Spatial Weights tests
+
+# import packages
+import os
+import sys
+import numpy as np
+import geopandas
+import pytest
+from shapely.geometry import box
+
+# the modules are kept at the repository root
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import SpatialWeights  # noqa: E402
+
+
+def three_msas():
+    """Three unit squares in a row, the middle one touching both others."""
+    return geopandas.GeoDataFrame(
+        {'CBSAFP': ['10180', '10420', '10500']},
+        geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), box(2, 0, 3, 1)])
+
+
+def test_cached_weights_reads_back_the_cache(tmp_path, monkeypatch):
+    gdf = three_msas()
+    w, ids = SpatialWeights.cached_weights(gdf, 'CBSAFP', 'queen',
+                                           cache_dir=str(tmp_path))
+
+    # a cache hit must not build the weights again
+    def fail(*args, **kwargs):
+        pytest.fail('weights were rebuilt instead of read from the cache')
+    monkeypatch.setattr(SpatialWeights, 'build_weights', fail)
+    w_cached, ids_cached = SpatialWeights.cached_weights(
+        gdf, 'CBSAFP', 'queen', cache_dir=str(tmp_path))
+
+    np.testing.assert_array_equal(ids_cached, ids)
+    np.testing.assert_allclose(w_cached.toarray(), w.toarray())
+    np.testing.assert_allclose(w.toarray(), [[0, 1, 0],
+                                             [0.5, 0, 0.5],
+                                             [0, 1, 0]])
+
+
+def test_cached_weights_rebuilds_for_new_ids(tmp_path):
+    gdf = three_msas()
+    SpatialWeights.cached_weights(gdf, 'CBSAFP', 'queen',
+                                  cache_dir=str(tmp_path))
+    gdf['CBSAFP'] = ['10180', '10420', '10740']
+    _, ids = SpatialWeights.cached_weights(gdf, 'CBSAFP', 'queen',
+                                           cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(ids, ['10180', '10420', '10740'])